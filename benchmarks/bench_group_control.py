@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Measures how long group control takes to mute and set the volume of every
+client of a group, for groups of 1, 10, 100 and 1000 clients. The calls go
+through SnapcastRpcWrapper to a fake snapserver that answers every HTTP
+request after a simulated network round trip. Batched requests, as used by
+group control, are compared with one request per client.
+
+    PYTHONPATH=. python benchmarks/bench_group_control.py [--rtt MS] [--serial-limit N]
+"""
+
+import argparse
+import threading
+import time
+
+from snapcastmpris.SnapcastFakeServer import FakeSnapserver, read_client_ids
+from snapcastmpris.SnapcastRpcWrapper import SnapcastRpcWrapper
+
+GROUP_SIZES = [1, 10, 100, 1000]
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def set_volumes_serially(rpc_wrapper, volumes):
+    for client_id, volume_level in volumes.items():
+        rpc_wrapper.call_snapserver_jsonrcp({"id": 8, "jsonrpc": "2.0", "method": "Client.SetVolume",
+                                             "params": {"id": client_id, "volume": {"percent": volume_level}}})
+
+
+def measure(group_size, rtt, serial_limit):
+    """
+    :return: (status, batched mute, batched volume, serial volume or None) in seconds
+    """
+    # Our own client has to be in the group, so get_client_id finds it
+    client_ids = read_client_ids()[:1]
+    client_ids += ["00:00:00:00:{:02x}:{:02x}".format(index // 256, index % 256)
+                   for index in range(group_size - len(client_ids))]
+    server = FakeSnapserver(client_ids, delay=rtt)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        rpc_wrapper = SnapcastRpcWrapper("127.0.0.1", server.server_address[1])
+        status = timed(rpc_wrapper.get_server_status)
+        mute = timed(rpc_wrapper.set_client_mutes, {client_id: True for client_id in client_ids})
+        volumes = {client_id: 40 for client_id in client_ids}
+        volume = timed(rpc_wrapper.set_client_volumes, volumes)
+        serial = timed(set_volumes_serially, rpc_wrapper, volumes) if group_size <= serial_limit else None
+    finally:
+        server.shutdown()
+        server.server_close()
+    return status, mute, volume, serial
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark group control against large groups')
+    parser.add_argument('--rtt', default=5, type=float, help='simulated round trip time to snapserver in ms')
+    parser.add_argument('--serial-limit', default=100, type=int,
+                        help='largest group to also set one client at a time, 100 by default')
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>12} {:>12}".format("clients", "status ms", "mute ms", "volume ms", "serial ms"))
+    for group_size in GROUP_SIZES:
+        status, mute, volume, serial = measure(group_size, args.rtt / 1000, args.serial_limit)
+        print("{:8d} {:12.1f} {:12.1f} {:12.1f} {:>12}".format(
+            group_size, status * 1000, mute * 1000, volume * 1000,
+            "{:.1f}".format(serial * 1000) if serial is not None else "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Measures what logging costs when snapserver notifications arrive. A fixed
+burst of websocket frames is replayed through
+SnapcastRpcWebsocketWrapper.on_ws_message: every simulated second a
+Client.OnConnect for each client, one Stream.OnUpdate and one
+Stream.OnProperties. The burst runs at INFO and at DEBUG, with the log
+format of snapcastmpris and the output kept in memory. Reported are the
+bytes and records logged and the time per frame.
+
+    PYTHONPATH=. python benchmarks/bench_logging.py [--clients N] [--seconds N] [--repeat N]
+"""
+
+import argparse
+import io
+import json
+import logging
+import time
+
+from snapcastmpris.SnapcastRpcListener import SnapcastRpcListener
+from snapcastmpris.SnapcastRpcWebsocketWrapper import SnapcastRpcWebsocketWrapper
+
+# As configured by snapcastmpris
+LOG_FORMAT = '%(levelname)s: %(name)s - %(message)s'
+STREAM_ID = "default"
+
+
+class CountingHandler(logging.StreamHandler):
+
+    def __init__(self):
+        super().__init__(io.StringIO())
+        self.records = 0
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def emit(self, record):
+        self.records += 1
+        super().emit(record)
+
+    def get_bytes(self):
+        return len(self.stream.getvalue().encode("utf-8"))
+
+
+class SimulatedClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client_id(index):
+    return "00:00:00:00:{:02x}:{:02x}".format(index // 256, index % 256)
+
+
+def notification(method, params):
+    return json.dumps({"jsonrpc": "2.0", "method": method, "params": params})
+
+
+def make_burst(clients, seconds):
+    """
+    :return: the frames of every simulated second
+    """
+    burst = []
+    for second in range(seconds):
+        frames = [notification("Client.OnConnect",
+                               {"id": make_client_id(index),
+                                "client": {"id": make_client_id(index), "connected": True,
+                                           "host": {"name": "speaker-{}".format(index)},
+                                           "config": {"name": "", "latency": 0,
+                                                      "volume": {"percent": 50, "muted": False}}}})
+                  for index in range(clients)]
+        properties = {"position": float(second), "playbackStatus": "playing", "canSeek": True,
+                      "metadata": {"title": "Track", "trackId": "track-1"}}
+        frames.append(notification("Stream.OnUpdate",
+                                   {"id": STREAM_ID, "stream": {"id": STREAM_ID, "status": "playing",
+                                                                "properties": properties}}))
+        frames.append(notification("Stream.OnProperties", {"id": STREAM_ID, "properties": properties}))
+        burst.append(frames)
+    return burst
+
+
+def replay(burst, level):
+    """
+    :return: (bytes logged, records logged, seconds per frame)
+    """
+    handler = CountingHandler()
+    package_logger = logging.getLogger("snapcastmpris")
+    package_logger.addHandler(handler)
+    package_logger.setLevel(level)
+    package_logger.propagate = False
+    try:
+        # Our own client is the first one
+        wrapper = SnapcastRpcWebsocketWrapper("127.0.0.1", 1780, make_client_id(0), SnapcastRpcListener(),
+                                              connect=False)
+        clock = SimulatedClock()
+        wrapper.log_sampler.clock = clock
+        frame_count = 0
+        started = time.perf_counter()
+        for second, frames in enumerate(burst):
+            clock.now = second
+            for frame in frames:
+                wrapper.on_ws_message(None, frame)
+            frame_count += len(frames)
+        elapsed = time.perf_counter() - started
+    finally:
+        package_logger.removeHandler(handler)
+        package_logger.propagate = True
+    return handler.get_bytes(), handler.records, elapsed / frame_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the logging of websocket notifications')
+    parser.add_argument('--clients', default=20, type=int, help='clients sending Client.OnConnect every second')
+    parser.add_argument('--seconds', default=60, type=int, help='simulated seconds of notifications')
+    parser.add_argument('--repeat', default=5, type=int, help='replays per level, the fastest counts')
+    args = parser.parse_args()
+
+    burst = make_burst(args.clients, args.seconds)
+    print("{} clients, {} frames in {} simulated seconds".format(
+        args.clients, sum(len(frames) for frames in burst), args.seconds))
+    print("{:>8} {:>12} {:>10} {:>14}".format("level", "KiB logged", "records", "us per frame"))
+    for level in (logging.INFO, logging.DEBUG):
+        results = [replay(burst, level) for _ in range(args.repeat)]
+        logged, records, _ = results[0]
+        per_frame = min(result[2] for result in results)
+        print("{:>8} {:12.1f} {:10d} {:14.1f}".format(
+            logging.getLevelName(level), logged / 1024, records, per_frame * 1000000))
+
+
+if __name__ == "__main__":
+    main()
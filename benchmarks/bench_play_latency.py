@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Measures how long Play waits for the other players to be paused, with
+native-pause (Pause sent to every MPRIS player at once through
+SnapcastMPRISInterface.pause_other_players) and with native-pause = 0 (the
+pause command run as a subprocess). Both go through
+SnapcastWrapper.pause_other_players, against a private session bus started
+with dbus-daemon and a few dummy MPRIS players that answer Pause.
+
+Without --pause-command, a stand-in for the HifiBerryOS pause-all is used:
+a Python script that pauses the players one by one through dbus-python.
+Needs dbus-daemon, dbus-python and PyGObject.
+
+    PYTHONPATH=. python benchmarks/bench_play_latency.py [--players N] [--repeat N] [--pause-command PATH]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import dbus
+import dbus.service
+from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
+
+from snapcastmpris.SnapcastFlightRecorder import SnapcastFlightRecorder
+from snapcastmpris.SnapcastMPRISInterface import SnapcastMPRISInterface
+from snapcastmpris.SnapcastWrapper import SnapcastWrapper
+
+PAUSE_ALL_SCRIPT = """#!{python}
+import sys
+import dbus
+
+bus = dbus.SessionBus()
+own_name = "org.mpris.MediaPlayer2." + sys.argv[1]
+for name in bus.list_names():
+    if not name.startswith("org.mpris.MediaPlayer2.") or name == own_name:
+        continue
+    try:
+        bus.get_object(name, "/org/mpris/MediaPlayer2").Pause(dbus_interface="org.mpris.MediaPlayer2.Player",
+                                                              timeout=0.5)
+    except dbus.DBusException as e:
+        print("Could not pause", name, e, file=sys.stderr)
+"""
+# How long to wait for the replies of the native Pause calls, in seconds
+REPLY_TIMEOUT = 1.0
+
+
+class DummyPlayer(dbus.service.Object):
+
+    @dbus.service.method(SnapcastMPRISInterface.PLAYER_INTERFACE)
+    def Pause(self):
+        pass
+
+
+def run_player(name, ready):
+    DBusGMainLoop(set_as_default=True)
+    bus = dbus.SessionBus()
+    DummyPlayer(bus, SnapcastMPRISInterface.PATH)
+    # The name is released when bus_name is collected
+    bus_name = dbus.service.BusName(name, bus=bus)
+    ready.set()
+    GLib.MainLoop().run()
+
+
+class PauseWrapper:
+    """
+    Just what SnapcastWrapper.pause_other_players needs
+    """
+
+    pause_other_players = SnapcastWrapper.pause_other_players
+
+    def __init__(self, dbus_service, native_pause, pause_command):
+        self.dbus_service = dbus_service
+        self.native_pause = native_pause
+        self.pause_command = pause_command
+        self.flight_recorder = SnapcastFlightRecorder()
+
+
+class RepliesHandler(logging.Handler):
+    """
+    Notices the log record pause_other_players emits once all players replied
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.replied_at = None
+
+    def emit(self, record):
+        if record.getMessage().startswith("Paused"):
+            self.replied_at = time.perf_counter()
+
+
+def start_session_bus():
+    """
+    :return: the dbus-daemon process, its address is set in DBUS_SESSION_BUS_ADDRESS
+    """
+    daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+                              stdout=subprocess.PIPE, universal_newlines=True)
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = daemon.stdout.readline().strip()
+    return daemon
+
+
+def create_interface(bus):
+    # Not exported, only what pause_other_players needs
+    interface = SnapcastMPRISInterface.__new__(SnapcastMPRISInterface)
+    interface.name = "org.mpris.MediaPlayer2.snapcast"
+    interface.bus = bus
+    interface.dbus_obj = bus.get_object("org.freedesktop.DBus", "/org/freedesktop/DBus")
+    interface.bus_name = dbus.service.BusName(interface.name, bus=bus)
+    return interface
+
+
+def measure_native(wrapper, handler):
+    """
+    :return: (time until Play continues, time until all players replied or
+        None if they didn't within REPLY_TIMEOUT) in seconds
+    """
+    handler.replied_at = None
+    context = GLib.MainContext.default()
+    started = time.perf_counter()
+    wrapper.pause_other_players()
+    returned = time.perf_counter() - started
+    while handler.replied_at is None and time.perf_counter() - started < REPLY_TIMEOUT:
+        context.iteration(True)
+    return returned, handler.replied_at - started if handler.replied_at is not None else None
+
+
+def measure_subprocess(wrapper):
+    started = time.perf_counter()
+    wrapper.pause_other_players()
+    return time.perf_counter() - started
+
+
+def describe(name, samples):
+    samples = sorted(sample for sample in samples if sample is not None)
+    if not samples:
+        print("{:>24} {:>10}".format(name, "-"))
+        return
+    print("{:>24} {:10.2f} {:10.2f} {:10.2f}".format(
+        name, statistics.median(samples) * 1000, samples[int(len(samples) * 0.9)] * 1000, samples[-1] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pausing other players on Play')
+    parser.add_argument('--players', default=5, type=int, help='dummy MPRIS players on the bus, 5 by default')
+    parser.add_argument('--repeat', default=50, type=int, help='Play calls per path')
+    parser.add_argument('--pause-command', type=str, help='pause command to run, a pause-all stand-in by default')
+    args = parser.parse_args()
+
+    daemon = start_session_bus()
+    players = []
+    script = None
+    try:
+        # The players are forked before this process connects to the bus
+        context = multiprocessing.get_context("fork")
+        for index in range(args.players):
+            ready = context.Event()
+            player = context.Process(target=run_player, args=("org.mpris.MediaPlayer2.dummy{}".format(index), ready),
+                                     daemon=True)
+            player.start()
+            ready.wait(5)
+            players.append(player)
+
+        pause_command = args.pause_command
+        if pause_command is None:
+            script = tempfile.NamedTemporaryFile("w", suffix="-pause-all", delete=False)
+            script.write(PAUSE_ALL_SCRIPT.format(python=sys.executable))
+            script.close()
+            os.chmod(script.name, 0o755)
+            pause_command = script.name
+
+        DBusGMainLoop(set_as_default=True)
+        interface = create_interface(dbus.SessionBus())
+        handler = RepliesHandler()
+        interface_logger = logging.getLogger("snapcastmpris.SnapcastMPRISInterface")
+        interface_logger.addHandler(handler)
+        interface_logger.setLevel(logging.INFO)
+
+        native = [measure_native(PauseWrapper(interface, True, pause_command), handler) for _ in range(args.repeat)]
+        spawned = [measure_subprocess(PauseWrapper(interface, False, pause_command)) for _ in range(args.repeat)]
+
+        print("{} other players, {} Play calls per path".format(args.players, args.repeat))
+        print("{:>24} {:>10} {:>10} {:>10}".format("", "median ms", "p90 ms", "max ms"))
+        describe("native, Play continues", [returned for returned, _ in native])
+        describe("native, all replied", [replied for _, replied in native])
+        missing = sum(1 for _, replied in native if replied is None)
+        if missing:
+            print("{} native Play calls got no reply from all players within {} s".format(missing, REPLY_TIMEOUT))
+        describe("subprocess", spawned)
+    finally:
+        for player in players:
+            player.terminate()
+            player.join()
+        if script is not None:
+            os.unlink(script.name)
+        daemon.terminate()
+        daemon.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Measures how long decoding a Server.GetStatus response takes and how much
+memory it needs at its peak, for 10, 100 and 1000 clients. The response is
+decoded both into plain dictionaries and into the models of SnapcastModels,
+the way SnapcastRpcWrapper.get_server_status does.
+
+    PYTHONPATH=. python benchmarks/bench_status_parse.py [--repeat N]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from snapcastmpris.SnapcastModels import parse_status_object
+
+CLIENT_COUNTS = [10, 100, 1000]
+CLIENTS_PER_GROUP = 4
+STREAM_COUNT = 4
+
+
+def make_client(index):
+    mac = "00:00:00:00:{:02x}:{:02x}".format(index // 256, index % 256)
+    return {
+        "config": {"instance": 1, "latency": 0, "name": "",
+                   "volume": {"muted": False, "percent": 50 + index % 50}},
+        "connected": index % 7 != 0,
+        "host": {"arch": "armv7l", "ip": "192.168.{}.{}".format(index // 250, index % 250 + 2),
+                 "mac": mac, "name": "speaker-{}".format(index), "os": "HiFiBerryOS"},
+        "id": mac,
+        "lastSeen": {"sec": 1700000000 + index, "usec": 123456},
+        "snapclient": {"name": "Snapclient", "protocolVersion": 2, "version": "0.27.0"},
+    }
+
+
+def make_status(client_count):
+    """
+    A Server.GetStatus response with the fields snapserver sends
+    """
+    clients = [make_client(index) for index in range(client_count)]
+    groups = [{"clients": clients[start:start + CLIENTS_PER_GROUP],
+               "id": "group-{}".format(start // CLIENTS_PER_GROUP),
+               "muted": False,
+               "name": "",
+               "stream_id": "stream-{}".format(start // CLIENTS_PER_GROUP % STREAM_COUNT)}
+              for start in range(0, client_count, CLIENTS_PER_GROUP)]
+    streams = [{"id": "stream-{}".format(index),
+                "properties": {"canControl": True, "canGoNext": True, "canGoPrevious": True, "canPause": True,
+                               "canPlay": True, "canSeek": False, "loopStatus": "none", "playbackStatus": "playing",
+                               "position": 42.5, "rate": 1.0, "shuffle": False, "volume": 100,
+                               "metadata": {"title": "Track", "artist": ["Artist"], "album": "Album",
+                                            "duration": 240.0, "trackId": "track-{}".format(index)}},
+                "status": "playing" if index == 0 else "idle",
+                "uri": {"fragment": "", "host": "", "path": "/tmp/stream-{}".format(index),
+                        "query": {"chunk_ms": "20", "codec": "flac", "name": "stream-{}".format(index),
+                                  "sampleformat": "48000:16:2"},
+                        "raw": "pipe:///tmp/stream-{}?name=stream-{}".format(index, index),
+                        "scheme": "pipe"}}
+               for index in range(STREAM_COUNT)]
+    return json.dumps({"id": 1, "jsonrpc": "2.0", "result": {"server": {
+        "groups": groups,
+        "server": {"host": {"arch": "x86_64", "ip": "", "mac": "", "name": "server", "os": "Linux"},
+                   "snapserver": {"controlProtocolVersion": 1, "name": "Snapserver", "protocolVersion": 1,
+                                  "version": "0.27.0"}},
+        "streams": streams}}})
+
+
+def measure(text, object_hook, repeat):
+    """
+    :return: (best decode time in seconds, peak memory in bytes)
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        json.loads(text, object_hook=object_hook)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        result = json.loads(text, object_hook=object_hook)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark decoding Server.GetStatus responses')
+    parser.add_argument('--repeat', default=20, type=int, help='decodes per measurement, the fastest counts')
+    args = parser.parse_args()
+
+    print("{:>8} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+        "clients", "JSON KiB", "dict ms", "dict KiB", "models ms", "models KiB"))
+    for client_count in CLIENT_COUNTS:
+        text = make_status(client_count)
+        dict_time, dict_peak = measure(text, None, args.repeat)
+        model_time, model_peak = measure(text, parse_status_object, args.repeat)
+        print("{:8d} {:10.1f} {:12.3f} {:12.1f} {:12.3f} {:12.1f}".format(
+            client_count, len(text) / 1024, dict_time * 1000, dict_peak / 1024,
+            model_time * 1000, model_peak / 1024))
+
+
+if __name__ == "__main__":
+    main()
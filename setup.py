@@ -25,6 +25,7 @@ setup(
     entry_points={
         "console_scripts": [
             "snapcastmpris=snapcastmpris.snapcastmpris:main",  # Replace `main` with the entry function
+            "snapcastmpris-replay=snapcastmpris.SnapcastTraceReplay:main",
         ]
     },
     classifiers=[
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SnapcastBufferController(threading.Thread):
+    """
+    Adapts the ALSA buffer time of snapclient to the underruns it reports.
+
+    A larger ALSA buffer protects against underruns of the sound device
+    when snapclient isn't scheduled in time, at the cost of a longer local
+    delay. snapclient compensates its own ALSA delay, so the room stays in
+    sync with the others. The client latency that can be set through
+    snapserver is not touched: it compensates the delay of the DAC and
+    raising it takes away buffer headroom.
+
+    Every interval, the buffer time is raised right after underruns and
+    lowered one step after several clean intervals. A new buffer time takes
+    effect when snapclient is restarted with it, until then its underruns
+    are not counted and no further decision is taken. on_change is called
+    with the new buffer time, so snapclient can be restarted at a safe
+    point. The round trip time and jitter to snapserver are only logged,
+    dropouts caused by the network need a larger buffer on snapserver.
+    """
+
+    def __init__(self, rpc_wrapper, min_buffer=80, max_buffer=400, step=20, interval=10, clean_intervals=30,
+                 rtt_interval=5, on_change=None):
+        super().__init__()
+        self.name = "SnapcastBufferController"
+        self.keep_running = True
+        self.rpc_wrapper = rpc_wrapper
+        self.min_buffer = min_buffer
+        self.max_buffer = max_buffer
+        self.step = step
+        self.interval = interval
+        self.clean_intervals = clean_intervals
+        self.rtt_interval = rtt_interval
+        self.on_change = on_change
+
+        self.lock = threading.Lock()
+        self.rtt = None
+        self.max_rtt = 0.0
+        self.jitter = 0.0
+        self.underruns = 0
+        self.reported_underruns = 0
+        self.stable_intervals = 0
+        self.buffer_time = min_buffer
+        # The buffer time the running snapclient was started with
+        self.snapclient_buffer_time = None
+
+    def snapclient_started(self):
+        """
+        Called when snapclient is started
+
+        :return: the ALSA buffer time in milliseconds to start it with
+        """
+        with self.lock:
+            self.snapclient_buffer_time = self.buffer_time
+            return self.buffer_time
+
+    def count_underrun(self, buffer_time):
+        """
+        Called for every buffer underrun that snapclient reports
+
+        :param buffer_time: the buffer time the reporting snapclient was started with
+        """
+        with self.lock:
+            # A snapclient on an outdated buffer says nothing about the current one
+            if buffer_time == self.buffer_time:
+                self.underruns += 1
+
+    def is_pending(self):
+        """
+        :return: True if the running snapclient doesn't use the current buffer time
+        """
+        with self.lock:
+            return self.snapclient_buffer_time is not None and self.snapclient_buffer_time != self.buffer_time
+
+    def get_buffer_time(self):
+        """
+        The ALSA buffer time in milliseconds snapclient should be started with
+        """
+        with self.lock:
+            return self.buffer_time
+
+    def run(self):
+        logger.info("Adaptive ALSA buffer enabled, between %d and %d ms", self.min_buffer, self.max_buffer)
+        next_decision = time.monotonic() + self.interval
+        next_rtt = time.monotonic()
+        while self.keep_running:
+            if time.monotonic() >= next_rtt:
+                next_rtt += self.rtt_interval
+                self.measure_rtt()
+            if time.monotonic() >= next_decision:
+                next_decision += self.interval
+                self.adjust_buffer()
+            time.sleep(1)
+        logger.info("Adaptive buffer controller exited")
+
+    def measure_rtt(self):
+        try:
+            rtt = self.rpc_wrapper.ping() * 1000
+        except Exception as e:
+            logger.debug("Snapserver RTT measurement failed: %s", e)
+            return
+        if self.rtt is not None:
+            self.jitter += (abs(rtt - self.rtt) - self.jitter) / 16
+        self.rtt = rtt
+        self.max_rtt = max(self.max_rtt, rtt)
+
+    def adjust_buffer(self):
+        with self.lock:
+            underruns = self.underruns - self.reported_underruns
+            self.reported_underruns = self.underruns
+            buffer_time = self.buffer_time
+            snapclient_buffer_time = self.snapclient_buffer_time
+
+        target = buffer_time
+        if snapclient_buffer_time is not None and snapclient_buffer_time != buffer_time:
+            # Wait for snapclient to be restarted with the last change
+            decision = "pending"
+        elif underruns > 0:
+            decision = "raise"
+            self.stable_intervals = 0
+            target = buffer_time + self.step * underruns
+        else:
+            self.stable_intervals += 1
+            if self.stable_intervals >= self.clean_intervals and buffer_time > self.min_buffer:
+                decision = "lower"
+                self.stable_intervals = 0
+                target = buffer_time - self.step
+            else:
+                decision = "keep"
+        target = min(max(target, self.min_buffer), self.max_buffer)
+
+        logger.log(logging.INFO if target != buffer_time else logging.DEBUG,
+                   "buffer metrics: rtt=%.1fms max_rtt=%.1fms jitter=%.1fms underruns=%d buffer=%dms -> %dms (%s)",
+                   self.rtt or 0, self.max_rtt, self.jitter, underruns, buffer_time, target, decision)
+        # The maximum only covers the last interval
+        self.max_rtt = self.rtt or 0
+        if target == buffer_time:
+            return
+        with self.lock:
+            self.buffer_time = target
+        logger.info("snapclient will use an ALSA buffer of %d ms from its next start", target)
+        if self.on_change is not None:
+            self.on_change(target)
+
+    def stop(self):
+        self.keep_running = False
@@ -0,0 +1,179 @@
+"""
+Fake snapserver for soak runs and benchmarks. It answers JSON-RPC calls,
+single and batched, over HTTP and sends notifications over websocket
+sessions on the same port, like snapserver does.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def read_client_ids():
+    """
+    The MAC addresses get_client_id chooses from
+    """
+    client_ids = []
+    for interface in sorted(os.listdir("/sys/class/net/")):
+        if interface == "lo":
+            continue
+        try:
+            with open("/sys/class/net/" + interface + "/address") as address:
+                client_ids.append(address.readline()[0:17])
+        except OSError:
+            pass
+    return client_ids
+
+
+class FakeSnapserverHandler(socketserver.StreamRequestHandler):
+    """
+    Answers JSON-RPC calls over HTTP and keeps websocket sessions for
+    notifications, both on the same port like snapserver
+    """
+
+    def handle(self):
+        request_line = self.rfile.readline().decode()
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("upgrade", "").lower() == "websocket":
+            self.handle_websocket(headers)
+            return
+        body = self.rfile.read(int(headers.get("content-length", 0)))
+        if request_line.startswith("POST /control"):
+            self.server.control(json.loads(body))
+            result = b"{}"
+        else:
+            if self.server.delay:
+                time.sleep(self.server.delay)
+            result = json.dumps(self.server.call(json.loads(body))).encode()
+        self.wfile.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                         b"Content-Length: " + str(len(result)).encode() + b"\r\n\r\n" + result)
+
+    def handle_websocket(self, headers):
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest())
+        self.wfile.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        self.send_lock = threading.Lock()
+        with self.server.lock:
+            self.server.sessions.add(self)
+        try:
+            # Only the close frame of the client matters
+            while True:
+                header = self.rfile.read(2)
+                if len(header) < 2 or header[0] & 0x0f == 0x8:
+                    break
+                length = header[1] & 0x7f
+                if length == 126:
+                    length = int.from_bytes(self.rfile.read(2), "big")
+                elif length == 127:
+                    length = int.from_bytes(self.rfile.read(8), "big")
+                self.rfile.read(length + (4 if header[1] & 0x80 else 0))
+        except OSError:
+            pass
+        finally:
+            with self.server.lock:
+                self.server.sessions.discard(self)
+
+    def send_text(self, text):
+        payload = text.encode()
+        if len(payload) < 126:
+            header = bytes([0x81, len(payload)])
+        elif len(payload) < 65536:
+            header = bytes([0x81, 126]) + len(payload).to_bytes(2, "big")
+        else:
+            header = bytes([0x81, 127]) + len(payload).to_bytes(8, "big")
+        try:
+            with self.send_lock:
+                self.connection.sendall(header + payload)
+        except OSError:
+            pass
+
+
+class FakeSnapserver(socketserver.ThreadingTCPServer):
+    """
+    Fake snapserver on a free local port with one group holding all clients
+
+    POST /control with {"notification": "..."} sends a notification to all
+    websocket sessions, {"drop": true} drops them.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, client_ids, stream_ids=("default",), delay=0.0):
+        """
+        :param delay: seconds every JSON-RPC request takes, like a round trip over the network
+        """
+        super().__init__(("127.0.0.1", 0), FakeSnapserverHandler)
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.clients = {client_id: {"percent": 50, "muted": False} for client_id in client_ids}
+        self.stream_ids = list(stream_ids)
+        self.delay = delay
+
+    def control(self, command):
+        with self.lock:
+            sessions = list(self.sessions)
+        if "notification" in command:
+            for session in sessions:
+                session.send_text(command["notification"])
+        if command.get("drop"):
+            for session in sessions:
+                try:
+                    session.connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def notify(self, method, params):
+        self.control({"notification": json.dumps({"jsonrpc": "2.0", "method": method, "params": params})})
+
+    def call(self, request):
+        if isinstance(request, list):
+            return [self.call(single) for single in request]
+        try:
+            result = self.dispatch(request["method"], request.get("params", {}))
+        except KeyError as e:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32602, "message": str(e)}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def dispatch(self, method, params):
+        if method == "Server.GetRPCVersion":
+            return {"major": 2, "minor": 0, "patch": 0}
+        if method == "Server.GetStatus":
+            return {"server": self.status()}
+        if method == "Client.GetStatus":
+            return {"client": self.client(params["id"])}
+        if method == "Client.SetVolume":
+            with self.lock:
+                volume = self.clients[params["id"]]
+                volume.update(params["volume"])
+                volume = dict(volume)
+            self.notify("Client.OnVolumeChanged", {"id": params["id"], "volume": volume})
+            return {"volume": volume}
+        if method in ("Client.SetLatency", "Client.SetName", "Stream.Control"):
+            return "ok"
+        raise KeyError(method)
+
+    def client(self, client_id):
+        with self.lock:
+            volume = dict(self.clients[client_id])
+        return {"id": client_id, "connected": True, "host": {"name": "fake"},
+                "config": {"name": "", "latency": 0, "volume": volume}}
+
+    def status(self):
+        return {"groups": [{"id": "group", "name": "", "stream_id": "default", "muted": False,
+                            "clients": [self.client(client_id) for client_id in list(self.clients)]}],
+                "streams": [{"id": stream_id, "status": "idle", "uri": {"raw": "pipe:///tmp/" + stream_id}}
+                            for stream_id in self.stream_ids]}
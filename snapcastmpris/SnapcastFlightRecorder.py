@@ -0,0 +1,78 @@
+import collections
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class SnapcastFlightRecorder:
+    """
+    Keeps the timings of the last processed events in a fixed-size ring.
+
+    Every event or command is one span, e.g. a websocket message or a D-Bus
+    method call. Work done while the span is active, such as decoding, RPC
+    calls and D-Bus emissions, is recorded as a stage of that span. Spans are
+    tracked per thread, so stages don't need to know which event they
+    belong to.
+    """
+
+    def __init__(self, size=256):
+        self.spans = collections.deque(maxlen=size)
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, kind, name=None):
+        current = getattr(self.local, "span", None)
+        if current is not None:
+            # Already inside an event, e.g. a command triggered by a notification
+            with self.stage(kind if name is None else kind + ":" + name):
+                yield
+            return
+
+        started = time.perf_counter()
+        current = {"time": time.time(), "started": started, "kind": kind, "name": name, "stages": []}
+        self.local.span = current
+        try:
+            yield
+        finally:
+            self.local.span = None
+            current["duration_us"] = int((time.perf_counter() - started) * 1000000)
+            self.spans.append(current)
+
+    @contextmanager
+    def stage(self, name):
+        current = getattr(self.local, "span", None)
+        if current is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            current["stages"].append((name, started, time.perf_counter() - started))
+
+    def annotate(self, name):
+        """
+        Name the current span, for events whose name is only known after decoding
+        """
+        current = getattr(self.local, "span", None)
+        if current is not None:
+            current["name"] = name
+
+    def dump(self):
+        """
+        Return the recorded spans as JSON, oldest first
+        """
+        spans = []
+        for span in list(self.spans):
+            spans.append({
+                "time": span["time"],
+                "kind": span["kind"],
+                "name": span["name"],
+                "duration_us": span["duration_us"],
+                "stages": [{"name": name,
+                            "offset_us": int((started - span["started"]) * 1000000),
+                            "duration_us": int(duration * 1000000)}
+                           for name, started, duration in span["stages"]],
+            })
+        return json.dumps(spans)
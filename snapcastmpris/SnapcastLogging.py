@@ -0,0 +1,65 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Short names for the loggers that can be configured with log-level-<name>
+SUBSYSTEM_LOGGERS = {
+    "main": "snapcastmpris.snapcastmpris",
+    "wrapper": "snapcastmpris.SnapcastWrapper",
+    "rpc": "snapcastmpris.SnapcastRpcWrapper",
+    "websocket": "snapcastmpris.SnapcastRpcWebsocketWrapper",
+    "mpris": "snapcastmpris.SnapcastMPRISInterface",
+    "buffer": "snapcastmpris.SnapcastBufferController",
+}
+
+
+class SnapcastLogSampler:
+    """
+    Rate limits repetitive log messages.
+
+    Per key, at most one message is logged per interval. The next message
+    that is logged reports how many were suppressed in between. Nothing is
+    formatted when the level is disabled.
+    """
+
+    def __init__(self, logger_instance, interval=10.0, clock=time.monotonic):
+        self.logger = logger_instance
+        self.interval = interval
+        self.clock = clock
+        # key -> (time of the last logged message, number of suppressed messages)
+        self.state = {}
+
+    def log(self, level, key, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = self.clock()
+        last, suppressed = self.state.get(key, (None, 0))
+        if last is not None and now - last < self.interval:
+            self.state[key] = (last, suppressed + 1)
+            return
+        self.state[key] = (now, 0)
+        if suppressed:
+            msg += " (%d similar messages suppressed)"
+            args += (suppressed,)
+        self.logger.log(level, msg, *args)
+
+
+def configure_log_levels(config, section="snapcast"):
+    """
+    Apply log-level-<subsystem> = <level> options from the configuration,
+    e.g. log-level-websocket = warning
+    """
+    if not config.has_section(section):
+        return
+    for option, value in config.items(section):
+        if not option.startswith("log-level-"):
+            continue
+        subsystem = option[len("log-level-"):]
+        name = SUBSYSTEM_LOGGERS.get(subsystem, "snapcastmpris." + subsystem)
+        level = logging.getLevelName(value.strip().upper())
+        if not isinstance(level, int):
+            logger.warning("Ignoring unknown log level %s for %s", value, subsystem)
+            continue
+        logging.getLogger(name).setLevel(level)
+        logger.info("Log level for %s set to %s", subsystem, logging.getLevelName(level))
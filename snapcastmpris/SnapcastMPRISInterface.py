@@ -6,7 +6,22 @@ import subprocess
 import json
 import signal
 import dbus.service
-import snapcastmpris.SnapcastWrapper
+from snapcastmpris.SnapcastPlaybackState import PLAYBACK_PLAYING, PLAYBACK_PAUSED, PLAYBACK_STOPPED, PLAYBACK_UNKNOWN
+from snapcastmpris.SnapcastTraceRecorder import TRACE_DBUS
+
+logger = logging.getLogger(__name__)
+
+NO_TRACK = "/org/mpris/MediaPlayer2/TrackList/NoTrack"
+TRACK_PATH = "/org/hifiberry/snapcast/track"
+
+
+def object_path_element(value):
+    """
+    Escape a string for use as an element of a D-Bus object path, which may
+    only contain [A-Za-z0-9_]
+    """
+    return "".join(chr(byte) if chr(byte).isalnum() and byte < 128 else "_{:02x}".format(byte)
+                   for byte in value.encode("utf-8")) or "_"
 
 
 class SnapcastMPRISInterface(dbus.service.Object):
@@ -17,6 +32,8 @@ class SnapcastMPRISInterface(dbus.service.Object):
     PROP_INTERFACE = dbus.PROPERTIES_IFACE
     PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
     ROOT_INTERFACE = "org.mpris.MediaPlayer2"
+    DEBUG_INTERFACE = "org.hifiberry.SnapcastMPRIS.Debug"
+    SNAPCAST_INTERFACE = "org.hifiberry.Snapcast"
 
     IDENTITY = "Snapcast client"
 
@@ -126,6 +143,28 @@ class SnapcastMPRISInterface(dbus.service.Object):
           <annotation name="org.freedesktop.DBus.Property.EmitsChangedSignal" value="false"/>
         </property>
       </interface>
+      <interface name="org.hifiberry.Snapcast">
+        <method name="GetState">
+          <arg direction="out" name="state" type="s"/>
+        </method>
+        <method name="SetClientVolumes">
+          <arg direction="in" name="volumes" type="a{si}"/>
+        </method>
+        <method name="SetClientMutes">
+          <arg direction="in" name="mutes" type="a{sb}"/>
+        </method>
+        <signal name="StateChanged">
+          <arg name="changes" type="s"/>
+        </signal>
+      </interface>
+      <interface name="org.hifiberry.SnapcastMPRIS.Debug">
+        <method name="DumpTimings">
+          <arg direction="out" name="timings" type="s"/>
+        </method>
+        <method name="DumpTransitions">
+          <arg direction="out" name="transitions" type="s"/>
+        </method>
+      </interface>
     </node>"""
 
     def __init__(self, wrapper_instance, glib_loop):
@@ -143,7 +182,7 @@ class SnapcastMPRISInterface(dbus.service.Object):
                                         arg0=self.name)
 
         self.bus_name = self.acquire_name()
-        logging.info("name on DBus aqcuired")
+        logger.info("name on DBus aqcuired")
 
     def name_owner_changed_callback(self, name, old_owner, new_owner):
         if name == self.name and old_owner == self.uname and new_owner != "":
@@ -151,7 +190,7 @@ class SnapcastMPRISInterface(dbus.service.Object):
                 pid = self._dbus_obj.GetConnectionUnixProcessID(new_owner)
             except:
                 pid = None
-            logging.info("Replaced by %s (PID %s)" %
+            logger.info("Replaced by %s (PID %s)" %
                          (new_owner, pid or "unknown"))
             self.glib_loop.quit()
 
@@ -165,32 +204,77 @@ class SnapcastMPRISInterface(dbus.service.Object):
         if hasattr(self, "_bus_name"):
             del self.bus_name
 
+    def pause_other_players(self, timeout=0.5):
+        """
+        Send Pause to all other MPRIS players on the bus at once. The calls
+        are asynchronous, the replies are only logged.
+        """
+        started = time.perf_counter()
+        names = [str(name) for name in self.dbus_obj.ListNames(dbus_interface="org.freedesktop.DBus")
+                 if name.startswith(SnapcastMPRISInterface.ROOT_INTERFACE + ".") and name != self.name]
+        pending = set(names)
+
+        def on_reply(name, error=None):
+            pending.discard(name)
+            if error is not None:
+                logger.debug("Could not pause %s: %s", name, error)
+            if not pending:
+                logger.info("Paused %d other players in %.1f ms", len(names), (time.perf_counter() - started) * 1000)
+
+        for name in names:
+            self.bus.call_async(name, SnapcastMPRISInterface.PATH, SnapcastMPRISInterface.PLAYER_INTERFACE,
+                                "Pause", "", (),
+                                lambda *args, player=name: on_reply(player),
+                                lambda error, player=name: on_reply(player, error),
+                                timeout=timeout)
+        logger.debug("Sent Pause to %d other players in %.1f ms", len(names), (time.perf_counter() - started) * 1000)
+
     @dbus.service.method(INTROSPECT_INTERFACE)
     def Introspect(self):
         return SnapcastMPRISInterface.MPRIS2_INTROSPECTION
 
+    def get_track_id(self):
+        """
+        MPRIS track id of the current track, built from the stream and the
+        track id snapserver reports for it
+        """
+        stream_id = self.wrapper_instance.stream_id
+        if stream_id is None:
+            return NO_TRACK
+        path = TRACK_PATH + "/" + object_path_element(stream_id)
+        track_id = self.wrapper_instance.stream_track_id
+        if track_id is not None:
+            path += "/" + object_path_element(str(track_id))
+        return path
+
     def get_metadata(self):
-        return dbus.Dictionary(self.wrapper_instance.metadata, signature='sv')
+        metadata = dict(self.wrapper_instance.metadata)
+        metadata["mpris:trackid"] = dbus.ObjectPath(self.get_track_id())
+        return dbus.Dictionary(metadata, signature='sv')
 
     def get_dbus_playback_status(self):
         status = self.wrapper_instance.playback_status
-        return {SnapcastWrapper.PLAYBACK_PLAYING: 'Playing',
-                SnapcastWrapper.PLAYBACK_PAUSED: 'Paused',
-                SnapcastWrapper.PLAYBACK_STOPPED: 'Stopped',
-                SnapcastWrapper.PLAYBACK_UNKNOWN: 'Unknown'}[status]
+        return {PLAYBACK_PLAYING: 'Playing',
+                PLAYBACK_PAUSED: 'Paused',
+                PLAYBACK_STOPPED: 'Stopped',
+                PLAYBACK_UNKNOWN: 'Unknown'}[status]
+
+    def get_position(self):
+        return dbus.Int64(self.wrapper_instance.position_tracker.get_position())
 
     def get_prop_mapping(self):
         player_props = {
             "PlaybackStatus": (self.get_dbus_playback_status, None),
             "Rate": (1.0, None),
             "Metadata": (self.get_metadata, None),
+            "Position": (self.get_position, None),
             "MinimumRate": (1.0, None),
             "MaximumRate": (1.0, None),
-            "CanGoNext": (False, None),
-            "CanGoPrevious": (False, None),
+            "CanGoNext": (lambda: self.wrapper_instance.can_control_stream("canGoNext"), None),
+            "CanGoPrevious": (lambda: self.wrapper_instance.can_control_stream("canGoPrevious"), None),
             "CanPlay": (True, None),
             "CanPause": (True, None),
-            "CanSeek": (False, None),
+            "CanSeek": (lambda: self.wrapper_instance.can_control_stream("canSeek"), None),
             "CanControl": (True, None),
         }
 
@@ -214,6 +298,10 @@ class SnapcastMPRISInterface(dbus.service.Object):
                           invalidated_properties):
         pass
 
+    @dbus.service.signal(PLAYER_INTERFACE, signature="x")
+    def Seeked(self, position):
+        pass
+
     @dbus.service.method(PROP_INTERFACE,
                          in_signature="ss", out_signature="v")
     def Get(self, interface, prop):
@@ -246,32 +334,95 @@ class SnapcastMPRISInterface(dbus.service.Object):
             value = getter()
         else:
             value = getter
-        logging.debug('Updated property: %s = %s' % (prop, value))
-        self.PropertiesChanged(interface, {prop: value}, [])
+        logger.debug('Updated property: %s = %s', prop, value)
+        with self.wrapper_instance.flight_recorder.stage("dbus:" + prop):
+            self.PropertiesChanged(interface, {prop: value}, [])
         return value
 
+    def run_command(self, name, action, *args):
+        """
+        Record a D-Bus command in the trace and hand it to the command worker
+        of the wrapper. The method call returns right away, property changes
+        are published when the command has been executed.
+        """
+        self.wrapper_instance.trace_recorder.record(TRACE_DBUS, [name] + list(args))
+        self.wrapper_instance.submit_command("dbus", name, action, *args)
+
     # Player methods
     @dbus.service.method(PLAYER_INTERFACE, in_signature='', out_signature='')
     def Pause(self):
-        logging.debug("received DBUS pause")
-        self.wrapper_instance.pause_playback()
+        logger.debug("received DBUS pause")
+        self.run_command("Pause", self.wrapper_instance.pause_playback)
 
     @dbus.service.method(PLAYER_INTERFACE, in_signature='', out_signature='')
     def PlayPause(self):
-        logging.debug("received DBUS play/pause")
-        status = self.wrapper_instance.playback_status
-
-        if status == SnapcastWrapper.PLAYBACK_PLAYING:
-            self.wrapper_instance.pause_playback()
-        else:
-            self.wrapper_instance.start_playback()
+        logger.debug("received DBUS play/pause")
+        self.run_command("PlayPause", self.wrapper_instance.toggle_playback)
 
     @dbus.service.method(PLAYER_INTERFACE, in_signature='', out_signature='')
     def Stop(self):
-        logging.debug("received DBUS stop")
-        self.wrapper_instance.stop_playback()
+        logger.debug("received DBUS stop")
+        self.run_command("Stop", self.wrapper_instance.stop_playback)
 
     @dbus.service.method(PLAYER_INTERFACE, in_signature='', out_signature='')
     def Play(self):
-        logging.debug("received DBUS play")
-        self.wrapper_instance.start_playback()
+        logger.debug("received DBUS play")
+        self.run_command("Play", self.wrapper_instance.start_playback)
+
+    @dbus.service.method(PLAYER_INTERFACE, in_signature='', out_signature='')
+    def Next(self):
+        logger.debug("received DBUS next")
+        self.run_command("Next", self.wrapper_instance.next_track)
+
+    @dbus.service.method(PLAYER_INTERFACE, in_signature='', out_signature='')
+    def Previous(self):
+        logger.debug("received DBUS previous")
+        self.run_command("Previous", self.wrapper_instance.previous_track)
+
+    @dbus.service.method(PLAYER_INTERFACE, in_signature='x', out_signature='')
+    def Seek(self, offset):
+        logger.debug("received DBUS seek")
+        self.run_command("Seek", self.wrapper_instance.seek, int(offset))
+
+    @dbus.service.method(PLAYER_INTERFACE, in_signature='ox', out_signature='')
+    def SetPosition(self, track_id, position):
+        logger.debug("received DBUS set position")
+        if str(track_id) != self.get_track_id():
+            # Stale call for a track that isn't playing anymore
+            logger.debug("Ignoring SetPosition for %s, the current track is %s", track_id, self.get_track_id())
+            return
+        self.run_command("SetPosition", self.wrapper_instance.set_position, int(position))
+
+    # Snapcast methods
+    @dbus.service.method(SNAPCAST_INTERFACE, in_signature='', out_signature='s')
+    def GetState(self):
+        return json.dumps(self.wrapper_instance.server_state.snapshot())
+
+    @dbus.service.method(SNAPCAST_INTERFACE, in_signature='a{si}', out_signature='')
+    def SetClientVolumes(self, volumes):
+        logger.debug("received DBUS set client volumes")
+        self.run_command("SetClientVolumes", self.wrapper_instance.set_client_volumes,
+                         {str(client_id): int(volume) for client_id, volume in volumes.items()})
+
+    @dbus.service.method(SNAPCAST_INTERFACE, in_signature='a{sb}', out_signature='')
+    def SetClientMutes(self, mutes):
+        logger.debug("received DBUS set client mutes")
+        self.run_command("SetClientMutes", self.wrapper_instance.set_client_mutes,
+                         {str(client_id): bool(muted) for client_id, muted in mutes.items()})
+
+    @dbus.service.signal(SNAPCAST_INTERFACE, signature='s')
+    def StateChanged(self, changes):
+        """
+        Emitted with the changed fields of every group, client and stream as
+        JSON, removed entries are null
+        """
+        pass
+
+    # Debug methods
+    @dbus.service.method(DEBUG_INTERFACE, in_signature='', out_signature='s')
+    def DumpTimings(self):
+        return self.wrapper_instance.flight_recorder.dump()
+
+    @dbus.service.method(DEBUG_INTERFACE, in_signature='', out_signature='s')
+    def DumpTransitions(self):
+        return json.dumps(self.wrapper_instance.playback.dump())
@@ -0,0 +1,146 @@
+"""
+Compact models of the snapserver state.
+
+Server.GetStatus returns a large document on installations with many
+clients. parse_status_object is used as object_hook while decoding it, so
+every client, group and stream object is replaced by its model as soon as
+it has been decoded. Only the fields used here are kept, the full tree of
+dictionaries never exists at once.
+"""
+
+
+class SnapcastClient:
+    __slots__ = ("id", "name", "connected", "volume", "muted", "latency")
+
+    def __init__(self, client_id, name="", connected=False, volume=100, muted=False, latency=0):
+        self.id = client_id
+        self.name = name
+        self.connected = connected
+        self.volume = volume
+        self.muted = muted
+        self.latency = latency
+
+    @classmethod
+    def from_json(cls, data):
+        config = data.get("config", {})
+        volume = config.get("volume", {})
+        return cls(data["id"],
+                   config.get("name") or data.get("host", {}).get("name", ""),
+                   data.get("connected", False),
+                   volume.get("percent", 100),
+                   volume.get("muted", False),
+                   config.get("latency", 0))
+
+    def to_json(self):
+        return {"id": self.id, "name": self.name, "connected": self.connected,
+                "volume": self.volume, "muted": self.muted, "latency": self.latency}
+
+
+class SnapcastGroup:
+    __slots__ = ("id", "name", "stream_id", "muted", "clients")
+
+    def __init__(self, group_id, name="", stream_id="", muted=False, clients=None):
+        self.id = group_id
+        self.name = name
+        self.stream_id = stream_id
+        self.muted = muted
+        self.clients = clients if clients is not None else []
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["id"], data.get("name", ""), data.get("stream_id", ""), data.get("muted", False),
+                   [client for client in data.get("clients", []) if isinstance(client, SnapcastClient)])
+
+    def to_json(self):
+        return {"id": self.id, "name": self.name, "stream_id": self.stream_id, "muted": self.muted,
+                "clients": [client.id for client in self.clients]}
+
+
+class SnapcastStream:
+    __slots__ = ("id", "status")
+
+    def __init__(self, stream_id, status="idle"):
+        self.id = stream_id
+        self.status = status
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data["id"], data.get("status", "idle"))
+
+    def to_json(self):
+        return {"id": self.id, "status": self.status}
+
+
+class SnapcastServer:
+    __slots__ = ("groups", "streams")
+
+    def __init__(self, groups=None, streams=None):
+        self.groups = groups if groups is not None else []
+        self.streams = streams if streams is not None else []
+
+    @classmethod
+    def from_json(cls, data):
+        return cls([group for group in data.get("groups", []) if isinstance(group, SnapcastGroup)],
+                   [stream for stream in data.get("streams", []) if isinstance(stream, SnapcastStream)])
+
+    def clients(self):
+        for group in self.groups:
+            yield from group.clients
+
+    def get_client(self, client_id):
+        for client in self.clients():
+            if client.id == client_id:
+                return client
+        return None
+
+    def get_group_of_client(self, client_id):
+        for group in self.groups:
+            for client in group.clients:
+                if client.id == client_id:
+                    return group
+        return None
+
+    def get_group(self, group_id):
+        for group in self.groups:
+            if group.id == group_id:
+                return group
+        return None
+
+    def get_stream(self, stream_id):
+        for stream in self.streams:
+            if stream.id == stream_id:
+                return stream
+        return None
+
+    def to_json(self):
+        return {"groups": {group.id: group.to_json() for group in self.groups},
+                "clients": {client.id: client.to_json() for client in self.clients()},
+                "streams": {stream.id: stream.to_json() for stream in self.streams}}
+
+
+def parse_status_object(data):
+    """
+    json object_hook that turns snapserver status objects into models,
+    other objects are returned unchanged
+    """
+    if "clients" in data and "stream_id" in data:
+        return SnapcastGroup.from_json(data)
+    if "connected" in data and "config" in data:
+        return SnapcastClient.from_json(data)
+    if "groups" in data and "streams" in data:
+        return SnapcastServer.from_json(data)
+    if "status" in data and "uri" in data:
+        return SnapcastStream.from_json(data)
+    return data
+
+
+def parse_status_tree(data):
+    """
+    Turn an already decoded status document into models, e.g. the server
+    object of a Server.OnUpdate notification
+    """
+    if isinstance(data, dict):
+        return parse_status_object({key: parse_status_tree(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return [parse_status_tree(value) for value in data]
+    return data
@@ -0,0 +1,138 @@
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+PLAYBACK_STOPPED = "stopped"
+PLAYBACK_PAUSED = "pause"
+PLAYBACK_PLAYING = "playing"
+PLAYBACK_UNKNOWN = "unkown"
+
+# Inputs of the state machine
+EVENT_PLAY = "play"
+EVENT_PAUSE = "pause"
+EVENT_STOP = "stop"
+EVENT_AUTOSTART = "autostart"
+EVENT_STREAM_START = "stream_start"
+EVENT_STREAM_PAUSE = "stream_pause"
+EVENT_SERVER_MUTE = "server_mute"
+EVENT_SNAPCLIENT_DIED = "snapclient_died"
+
+# state: {event: new state}
+TRANSITIONS = {
+    PLAYBACK_STOPPED: {
+        EVENT_PLAY: PLAYBACK_PLAYING,
+        EVENT_STOP: PLAYBACK_STOPPED,
+        EVENT_AUTOSTART: PLAYBACK_PAUSED,
+        EVENT_STREAM_START: PLAYBACK_PLAYING,
+    },
+    PLAYBACK_PAUSED: {
+        EVENT_PLAY: PLAYBACK_PLAYING,
+        EVENT_PAUSE: PLAYBACK_PAUSED,
+        EVENT_STOP: PLAYBACK_STOPPED,
+        EVENT_AUTOSTART: PLAYBACK_PAUSED,
+        EVENT_STREAM_START: PLAYBACK_PLAYING,
+        EVENT_STREAM_PAUSE: PLAYBACK_PAUSED,
+        EVENT_SERVER_MUTE: PLAYBACK_PAUSED,
+        EVENT_SNAPCLIENT_DIED: PLAYBACK_STOPPED,
+    },
+    PLAYBACK_PLAYING: {
+        EVENT_PLAY: PLAYBACK_PLAYING,
+        EVENT_PAUSE: PLAYBACK_PAUSED,
+        EVENT_STOP: PLAYBACK_STOPPED,
+        EVENT_STREAM_START: PLAYBACK_PLAYING,
+        EVENT_STREAM_PAUSE: PLAYBACK_PAUSED,
+        EVENT_SERVER_MUTE: PLAYBACK_PAUSED,
+        EVENT_SNAPCLIENT_DIED: PLAYBACK_STOPPED,
+    },
+}
+
+# Events that are expected in a state, but have no effect there. snapclient
+# is started with the wrapper and can crash before playback has started.
+IGNORED_EVENTS = {
+    PLAYBACK_STOPPED: {EVENT_PAUSE, EVENT_STREAM_PAUSE, EVENT_SERVER_MUTE, EVENT_SNAPCLIENT_DIED},
+    PLAYBACK_PAUSED: set(),
+    PLAYBACK_PLAYING: set(),
+}
+
+# Number of transitions kept for DumpTransitions
+HISTORY_SIZE = 100
+
+
+class SnapcastPlaybackState:
+    """
+    Playback state of SnapcastWrapper, changed only through the transitions
+    in TRANSITIONS.
+
+    Transitions are only made by the command worker of the wrapper, which
+    is the single consumer of all inputs. Every transition is counted and
+    kept in a short history with the time it took from the input arriving
+    until the command had been handled.
+    """
+
+    def __init__(self, state=PLAYBACK_STOPPED):
+        self.state = state
+        self.changed_at = time.time()
+        self.transition_count = 0
+        # (from, event, to): [count, total seconds, max seconds]
+        self.statistics = collections.defaultdict(lambda: [0, 0.0, 0.0])
+        # (state, event): count
+        self.impossible = collections.Counter()
+        self.history = collections.deque(maxlen=HISTORY_SIZE)
+        self.pending = []
+
+    def transition(self, event):
+        """
+        Apply an event to the current state
+
+        :return: the new state, None if the event has no effect or is impossible in the current state
+        """
+        new_state = TRANSITIONS.get(self.state, {}).get(event)
+        if new_state is None:
+            if event in IGNORED_EVENTS.get(self.state, ()):
+                logger.debug("Ignoring %s in state %s", event, self.state)
+            else:
+                logger.warning("Impossible playback transition: %s in state %s", event, self.state)
+                self.impossible[(self.state, event)] += 1
+            return None
+        entry = {"time": time.time(), "from": self.state, "event": event, "to": new_state, "ms": None}
+        self.history.append(entry)
+        self.pending.append(entry)
+        self.transition_count += 1
+        self.state = new_state
+        self.changed_at = entry["time"]
+        return new_state
+
+    def complete(self, duration):
+        """
+        Called when the command that caused the pending transitions has been
+        handled
+
+        :param duration: seconds since the command was received
+        """
+        for entry in self.pending:
+            entry["ms"] = round(duration * 1000, 3)
+            statistics = self.statistics[(entry["from"], entry["event"], entry["to"])]
+            statistics[0] += 1
+            statistics[1] += duration
+            statistics[2] = max(statistics[2], duration)
+            logger.debug("Playback %s -> %s (%s) took %.1f ms", entry["from"], entry["to"], entry["event"],
+                         duration * 1000)
+        self.pending = []
+
+    def dump(self):
+        """
+        :return: the transition statistics, impossible transitions and recent history as a JSON-compatible dict
+        """
+        return {
+            "state": self.state,
+            "changed_at": self.changed_at,
+            "transitions": [{"from": key[0], "event": key[1], "to": key[2], "count": value[0],
+                             "mean_ms": round(value[1] / value[0] * 1000, 3),
+                             "max_ms": round(value[2] * 1000, 3)}
+                            for key, value in sorted(self.statistics.items())],
+            "impossible": [{"state": key[0], "event": key[1], "count": count}
+                           for key, count in sorted(self.impossible.items())],
+            "history": list(self.history),
+        }
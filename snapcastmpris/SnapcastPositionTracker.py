@@ -0,0 +1,76 @@
+import threading
+import time
+
+# A reported position may differ this much (in microseconds) from the
+# interpolated one before it is treated as a seek instead of jitter
+SEEK_TOLERANCE_US = 1000000
+
+
+class SnapcastPositionTracker:
+    """
+    Keeps track of the playback position of the current stream.
+
+    snapserver only reports the position when the stream properties change,
+    so the position in between is interpolated from the last reported
+    position, the time it was received and the playback rate.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.position_us = 0
+        self.timestamp = clock()
+        self.rate = 1.0
+        self.playing = False
+        # No position has been reported since the last reset
+        self.known = False
+
+    def interpolate(self, now):
+        if not self.playing:
+            return self.position_us
+        elapsed = now - self.timestamp
+        return max(0, self.position_us + int(elapsed * 1000000 * self.rate))
+
+    def get_position(self):
+        """
+        Get the current position in microseconds
+        """
+        with self.lock:
+            return self.interpolate(self.clock())
+
+    def update(self, position_us, rate=None, playing=None, reported_at=None):
+        """
+        Store a position reported by the server
+
+        :param reported_at: clock time the position was received, now by default
+        :return: True if the position jumped, e.g. because of a seek
+        """
+        now = self.clock() if reported_at is None else reported_at
+        with self.lock:
+            expected = self.interpolate(now)
+            self.position_us = max(0, int(position_us))
+            self.timestamp = now
+            if rate is not None:
+                self.rate = rate
+            if playing is not None:
+                self.playing = playing
+            if not self.known:
+                self.known = True
+                return False
+            return abs(self.position_us - expected) > SEEK_TOLERANCE_US
+
+    def set_playing(self, playing):
+        """
+        Freeze or resume the position without a new position report
+        """
+        now = self.clock()
+        with self.lock:
+            self.position_us = self.interpolate(now)
+            self.timestamp = now
+            self.playing = playing
+
+    def reset(self):
+        with self.lock:
+            self.position_us = 0
+            self.timestamp = self.clock()
+            self.known = False
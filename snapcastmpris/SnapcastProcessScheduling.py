@@ -0,0 +1,201 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import platform
+
+logger = logging.getLogger(__name__)
+
+SCHEDULING_POLICIES = {
+    "other": os.SCHED_OTHER,
+    "batch": getattr(os, "SCHED_BATCH", None),
+    "idle": getattr(os, "SCHED_IDLE", None),
+    "fifo": os.SCHED_FIFO,
+    "rr": os.SCHED_RR,
+}
+
+IOPRIO_CLASSES = {"none": 0, "rt": 1, "be": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1
+# Python has no ioprio_set/ioprio_get, their syscall numbers differ per architecture
+IOPRIO_SYSCALLS = {
+    "x86_64": (251, 252),
+    "i386": (289, 290),
+    "i686": (289, 290),
+    "armv6l": (314, 315),
+    "armv7l": (314, 315),
+    "aarch64": (30, 31),
+}
+
+
+def parse_cpus(value):
+    """
+    Parse a CPU list like "2,3" or "0-1,3"
+    """
+    cpus = set()
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    if not cpus:
+        raise ValueError("no CPUs in " + repr(value))
+    return cpus
+
+
+def parse_ioprio(value):
+    """
+    Parse an I/O priority like "be:4" or "idle"
+
+    :return: (class, level)
+    """
+    ioprio_class, _, level = value.partition(":")
+    if ioprio_class not in IOPRIO_CLASSES:
+        raise ValueError("unknown I/O priority class " + ioprio_class)
+    level = int(level or 0)
+    if not 0 <= level < 8:
+        raise ValueError("I/O priority level must be between 0 and 7")
+    return ioprio_class, level
+
+
+class SnapcastProcessScheduling:
+    """
+    Scheduling settings for the snapclient process: nice level, scheduling
+    policy and priority, CPU affinity and I/O priority.
+
+    The settings are applied to every thread of the process after it has
+    been started. Settings that can't be applied, e.g. real-time
+    scheduling without the required privileges, are reported and skipped.
+    """
+
+    def __init__(self, nice=None, policy=None, priority=0, cpus=None, ioprio=None):
+        self.nice = nice
+        self.policy = policy
+        self.priority = priority
+        self.cpus = cpus
+        # (class, level)
+        self.ioprio = ioprio
+
+    @classmethod
+    def from_config(cls, config, section="snapcast"):
+        """
+        Read the snapclient-* settings. Invalid values are logged and
+        skipped, they must not keep snapcastmpris from starting.
+        """
+        def read(key, parse, fallback=None):
+            value = config.get(section, key, fallback=None)
+            if value is None:
+                return fallback
+            try:
+                return parse(value)
+            except ValueError as e:
+                logger.warning("Ignoring invalid %s = %s: %s", key, value, e)
+                return fallback
+
+        policy = config.get(section, "snapclient-scheduler", fallback=None)
+        if policy is not None and SCHEDULING_POLICIES.get(policy.lower()) is None:
+            logger.warning("Ignoring unknown scheduling policy %s", policy)
+            policy = None
+        return cls(nice=read("snapclient-nice", int),
+                   policy=policy.lower() if policy is not None else None,
+                   priority=read("snapclient-priority", int, 0),
+                   cpus=read("snapclient-cpus", parse_cpus),
+                   ioprio=read("snapclient-ioprio", parse_ioprio))
+
+    @property
+    def requested(self):
+        return self.nice is not None or self.policy is not None or self.cpus is not None or self.ioprio is not None
+
+    def apply(self, pid):
+        """
+        Apply the settings to all threads of a process and read them back
+
+        :return: {setting: {"requested": ..., "applied": ..., "error": ...}}
+        """
+        report = {}
+        try:
+            threads = [int(tid) for tid in os.listdir("/proc/{}/task".format(pid))]
+        except OSError:
+            threads = [pid]
+
+        if self.nice is not None:
+            report["nice"] = self.apply_setting(
+                self.nice, threads,
+                lambda tid: os.setpriority(os.PRIO_PROCESS, tid, self.nice),
+                lambda: os.getpriority(os.PRIO_PROCESS, pid))
+        if self.policy is not None:
+            report["scheduler"] = self.apply_setting(
+                (self.policy, self.priority), threads,
+                lambda tid: os.sched_setscheduler(tid, SCHEDULING_POLICIES[self.policy],
+                                                  os.sched_param(self.priority)),
+                lambda: (self.policy_name(os.sched_getscheduler(pid)), os.sched_getparam(pid).sched_priority))
+        if self.cpus is not None:
+            report["cpus"] = self.apply_setting(
+                sorted(self.cpus), threads,
+                lambda tid: os.sched_setaffinity(tid, self.cpus),
+                lambda: sorted(os.sched_getaffinity(pid)))
+        if self.ioprio is not None:
+            report["ioprio"] = self.apply_setting(
+                self.ioprio, threads,
+                lambda tid: set_ioprio(tid, *self.ioprio),
+                lambda: get_ioprio(pid))
+
+        for setting, result in report.items():
+            if result["error"] is None and result["applied"] == result["requested"]:
+                logger.info("snapclient %s set to %s", setting, result["applied"])
+            else:
+                logger.warning("snapclient %s: requested %s, applied %s (%s)", setting,
+                               result["requested"], result["applied"], result["error"] or "not verified")
+        return report
+
+    @staticmethod
+    def apply_setting(requested, threads, set_value, get_value):
+        error = None
+        for tid in threads:
+            try:
+                set_value(tid)
+            except (OSError, ValueError) as e:
+                error = str(e)
+                break
+        try:
+            applied = get_value()
+        except (OSError, ValueError) as e:
+            applied = None
+            error = error or str(e)
+        return {"requested": requested, "applied": applied, "error": error}
+
+    @staticmethod
+    def policy_name(policy):
+        for name, value in SCHEDULING_POLICIES.items():
+            if value == policy:
+                return name
+        return policy
+
+
+def ioprio_syscall(index, *args):
+    numbers = IOPRIO_SYSCALLS.get(platform.machine())
+    if numbers is None:
+        raise OSError("I/O priorities are not supported on " + platform.machine())
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    result = libc.syscall(numbers[index], *args)
+    if result < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
+
+
+def set_ioprio(pid, ioprio_class, level):
+    ioprio_syscall(0, IOPRIO_WHO_PROCESS, pid, (IOPRIO_CLASSES[ioprio_class] << IOPRIO_CLASS_SHIFT) | level)
+
+
+def get_ioprio(pid):
+    value = ioprio_syscall(1, IOPRIO_WHO_PROCESS, pid)
+    ioprio_class = value >> IOPRIO_CLASS_SHIFT
+    for name, number in IOPRIO_CLASSES.items():
+        if number == ioprio_class:
+            return name, value & ((1 << IOPRIO_CLASS_SHIFT) - 1)
+    return ioprio_class, value & ((1 << IOPRIO_CLASS_SHIFT) - 1)
@@ -1,8 +1,17 @@
 class SnapcastRpcListener:
-    def on_snapserver_stream_pause(self):
+    def on_snapserver_notification(self, method, params):
         pass
 
-    def on_snapserver_stream_start(self, stream_name, stream_group):
+    def on_snapserver_reconnect(self):
+        pass
+
+    def on_snapserver_stream_pause(self, stream_id=None):
+        pass
+
+    def on_snapserver_stream_start(self, stream_name, stream_group, stream_id=None):
+        pass
+
+    def on_snapserver_stream_properties(self, stream_id, properties):
         pass
 
     def on_snapserver_volume_change(self, volume_level):
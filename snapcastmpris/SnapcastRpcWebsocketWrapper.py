@@ -4,27 +4,52 @@ import threading
 import websocket
 from snapcastmpris.SnapcastRpcWrapper import SnapcastRpcWrapper
 from snapcastmpris.SnapcastRpcListener import SnapcastRpcListener
+from snapcastmpris.SnapcastTraceRecorder import SnapcastTraceRecorder, TRACE_WEBSOCKET
+from snapcastmpris.SnapcastFlightRecorder import SnapcastFlightRecorder
+from snapcastmpris.SnapcastLogging import SnapcastLogSampler
+from snapcastmpris.SnapcastServerDiscovery import format_host
+
+logger = logging.getLogger(__name__)
 
 RPC_EVENT_CLIENT_VOLUME_CHANGE = "Client.OnVolumeChanged"
 RPC_EVENT_CLIENT_MUTE = "Client.OnMute"
 RPC_EVENT_CLIENT_CONNECT = "Client.OnConnect"
 RPC_EVENT_CLIENT_DISCONNECT = "Client.OnDisconnect"
 RPC_EVENT_STREAM_UPDATE = "Stream.OnUpdate"
+RPC_EVENT_STREAM_PROPERTIES = "Stream.OnProperties"
+
+# Time to wait before connecting again after the websocket was closed, in seconds
+RECONNECT_INTERVAL = 5
 
 
 class SnapcastRpcWebsocketWrapper:
 
-    def __init__(self, server_address: str, server_control_port, client_id, listener: SnapcastRpcListener):
+    def __init__(self, server_address: str, server_control_port, client_id, listener: SnapcastRpcListener,
+                 trace_recorder: SnapcastTraceRecorder = None, flight_recorder: SnapcastFlightRecorder = None,
+                 connect=True):
         self.healthy = True
         self.server_address = server_address
         self.server_control_port = server_control_port
         self.client_id = client_id
         self.listener = listener
+        self.trace_recorder = trace_recorder or SnapcastTraceRecorder()
+        self.flight_recorder = flight_recorder or SnapcastFlightRecorder()
 
         self.current_volume = None
-
+        # Client.OnConnect alone arrives every second for every client
+        self.log_sampler = SnapcastLogSampler(logger)
+
+        self.keep_running = True
+        self.stopped = threading.Event()
+        self.reconnect_interval = RECONNECT_INTERVAL
+        self.websocket = None
+        self.websocket_thread = None
+        if not connect:
+            # Messages are fed to on_ws_message directly, e.g. when replaying a trace
+            return
         self.websocket = websocket.WebSocketApp(
-            "ws://" + server_address + ":" + str(server_control_port) + "/jsonrpc",
+            "ws://" + format_host(server_address, escape_scope=False) + ":" + str(server_control_port) + "/jsonrpc",
+            on_open=self.on_ws_open,
             on_message=self.on_ws_message,
             on_error=self.on_ws_error,
             on_close=self.on_ws_close,
@@ -34,19 +59,42 @@ class SnapcastRpcWebsocketWrapper:
         self.websocket_thread.start()
 
     def websocket_loop(self):
-        logging.info("Started SnapcastRpcWebsocketWrapper loop")
-        self.websocket.run_forever()
-        logging.info("Ending SnapcastRpcWebsocketWrapper loop")
+        logger.info("Started SnapcastRpcWebsocketWrapper loop")
+        while self.keep_running:
+            self.websocket.run_forever()
+            if self.keep_running:
+                logger.info("Reconnecting to snapserver in %s seconds", self.reconnect_interval)
+                self.stopped.wait(self.reconnect_interval)
+        logger.info("Ending SnapcastRpcWebsocketWrapper loop")
+
+    def on_ws_open(self, object):
+        if not self.healthy:
+            logger.info("Snapcast RPC websocket connected again")
+            self.healthy = True
+            # Notifications sent while disconnected are lost
+            self.listener.on_snapserver_reconnect()
 
     def on_ws_message(self, object, message):
-        logging.debug("Snapcast RPC websocket message received")
-        logging.debug(message)
-        json_data = json.loads(message)
-
-        handlers = self.get_event_handlers_mapping()
-
-        event = json_data["method"]
-        handlers[event](json_data["params"])
+        self.trace_recorder.record(TRACE_WEBSOCKET, message)
+        with self.flight_recorder.span("ws"):
+            with self.flight_recorder.stage("decode"):
+                json_data = json.loads(message)
+
+            handlers = self.get_event_handlers_mapping()
+
+            event = json_data["method"]
+            self.flight_recorder.annotate(event)
+            if event == RPC_EVENT_CLIENT_CONNECT:
+                self.log_sampler.log(logging.DEBUG, event, "Snapcast RPC websocket message received: %s", message)
+            else:
+                logger.debug("Snapcast RPC websocket message received: %s", message)
+            with self.flight_recorder.stage("state"):
+                self.listener.on_snapserver_notification(event, json_data["params"])
+            handler = handlers.get(event)
+            if handler is None:
+                return
+            with self.flight_recorder.stage("handler"):
+                handler(json_data["params"])
 
     def get_event_handlers_mapping(self):
         return {
@@ -55,6 +103,7 @@ class SnapcastRpcWebsocketWrapper:
             RPC_EVENT_CLIENT_CONNECT: self.on_client_connect,
             RPC_EVENT_CLIENT_DISCONNECT: self.on_client_disconnect,
             RPC_EVENT_STREAM_UPDATE: self.on_stream_update,
+            RPC_EVENT_STREAM_PROPERTIES: self.on_stream_properties,
         }
 
     def on_volume_change(self, params: {}):
@@ -63,9 +112,9 @@ class SnapcastRpcWebsocketWrapper:
         volume = params['volume']['percent']
         # Don't trigger multiple times on the same volume
         if volume == self.current_volume:
-            logging.debug("Snapclient volume update, but no change: " + str(volume))
+            logger.debug("Snapclient volume update, but no change: %s", volume)
             return
-        logging.debug("Snapclient volume changed to " + str(volume))
+        logger.debug("Snapclient volume changed to %s", volume)
         self.listener.on_snapserver_volume_change(volume)
         self.current_volume = volume
 
@@ -74,10 +123,10 @@ class SnapcastRpcWebsocketWrapper:
             return
         is_muted = params['mute']
         if is_muted:
-            logging.info("Snapclient muted")
+            logger.info("Snapclient muted")
             self.listener.on_snapserver_mute()
         else:
-            logging.info("Snapclient unmuted")
+            logger.info("Snapclient unmuted")
             self.listener.on_snapserver_unmute()
 
     def on_client_connect(self, params: {}):
@@ -85,21 +134,22 @@ class SnapcastRpcWebsocketWrapper:
             return
         # Not used right now, but could be useful for status monitoring
         # This event is fired every second for every connected client
-        logging.debug("Client connected!")
+        self.log_sampler.log(logging.DEBUG, "connected", "Client connected!")
 
     def on_client_disconnect(self, params: {}):
         if not self.targeted_at_current_client(params):
             return
         # Not used right now, but could be useful for status monitoring
-        logging.info("Client disconnected!")
+        logger.info("Client disconnected!")
 
     def on_stream_update(self, params: {}):
         # There is a lot of information here, such as audio details
         # We focus on idle/playing right now
 
-        # TODO: we need to know/check if the stream is played on this client
-        # It might only be targeted at other players, in which case this player shouldn't do anything
+        # The stream might only be played by other groups, the listener
+        # checks it against the group of this client
         stream_group = ""
+        stream_id = params["id"]
         stream_status = params["stream"]["status"]
         # The stream name can be present in id, stream.id, or stream.meta.STREAM
         if "meta" in params["stream"]:
@@ -108,13 +158,21 @@ class SnapcastRpcWebsocketWrapper:
             stream_name = params["stream"]["id"]
 
         if stream_status == "playing":
-            logging.info("Snapclient stream started")
-            self.listener.on_snapserver_stream_start(stream_name, stream_group)
+            logger.info("Snapclient stream started")
+            self.listener.on_snapserver_stream_start(stream_name, stream_group, stream_id)
         elif stream_status == "idle":
-            logging.info("Snapclient stream idle")
-            self.listener.on_snapserver_stream_pause()
+            logger.info("Snapclient stream idle")
+            self.listener.on_snapserver_stream_pause(stream_id)
         else:
-            logging.warning("Snapclient stream has unknown status: " + stream_status)
+            logger.warning("Snapclient stream has unknown status: %s", stream_status)
+
+        # Since snapserver 0.26, the stream update contains the stream properties as well
+        if "properties" in params["stream"]:
+            self.listener.on_snapserver_stream_properties(stream_id, params["stream"]["properties"])
+
+    def on_stream_properties(self, params: {}):
+        # Playback position, capabilities and metadata reported by the stream source
+        self.listener.on_snapserver_stream_properties(params["id"], params["properties"])
 
     def targeted_at_current_client(self, params: {}):
         # This method works only for client-specific events!
@@ -122,14 +180,19 @@ class SnapcastRpcWebsocketWrapper:
 
     # noinspection PyMethodMayBeStatic
     def on_ws_error(self, object, error):
-        logging.error("Snapcast RPC websocket error")
-        logging.error(error)
+        logger.error("Snapcast RPC websocket error")
+        logger.error(error)
 
-    def on_ws_close(self, message):
-        logging.info("Snapcast RPC websocket closed!")
+    def on_ws_close(self, object, *args):
+        # websocket-client >= 1.0 passes the close status and message
+        logger.info("Snapcast RPC websocket closed!")
         self.healthy = False
 
     def stop(self):
-        self.websocket.keep_running = False
-        logging.info("Waiting for websocket thread to exit")
+        if self.websocket is None:
+            return
+        self.keep_running = False
+        self.stopped.set()
+        self.websocket.close()
+        logger.info("Waiting for websocket thread to exit")
         self.websocket_thread.join()
@@ -1,7 +1,13 @@
 import json
 from os import listdir
 import logging
+import time
 import requests
+from snapcastmpris.SnapcastFlightRecorder import SnapcastFlightRecorder
+from snapcastmpris.SnapcastServerDiscovery import format_host
+from snapcastmpris.SnapcastModels import SnapcastServer, parse_status_object
+
+logger = logging.getLogger(__name__)
 
 REQ_TAG_GET_SERVER_RPC_VERSION = 0
 REQ_TAG_SET_VOLUME = 1
@@ -10,35 +16,42 @@ REQ_TAG_SET_NAME = 3
 REQ_TAG_SET_LATENCY = 4
 REQ_TAG_GET_STATUS = 5
 REQ_TAG_GET_SERVER_STATUS = 6
+REQ_TAG_STREAM_CONTROL = 7
+
+# A hung snapserver must not stall the RTT measurement, in seconds
+PING_TIMEOUT = 2
 
 
 class SnapcastRpcWrapper:
 
-    def __init__(self, server_address, server_control_port):
+    def __init__(self, server_address, server_control_port, flight_recorder: SnapcastFlightRecorder = None):
         """
         Create a new instance
 
         :param:server_address The ip of the snapcast server
         :param:listener a SnapcastRpcListener listener
+        :param:flight_recorder records the duration of RPC calls
         """
-        logging.debug("Initializing SnapcastRpcWrapper")
+        logger.debug("Initializing SnapcastRpcWrapper")
         self.server_address = server_address
         self.server_control_port = server_control_port
+        self.jsonrpc_url = 'http://' + format_host(server_address) + ":" + str(server_control_port) + "/jsonrpc"
+        self.flight_recorder = flight_recorder or SnapcastFlightRecorder()
         self.client_id = self.get_client_id()
         self.verify_srver_rpc_version()
-        logging.debug("Initialized SnapcastRpcWrapper")
+        logger.debug("Initialized SnapcastRpcWrapper")
 
-    def get_server_status(self):
-        logging.info("Getting snapserver clients")
+    def get_server_status(self) -> SnapcastServer:
+        logger.info("Getting snapserver clients")
         payload = \
             {"id": REQ_TAG_GET_SERVER_STATUS,
              "jsonrpc": "2.0",
              "method": "Server.GetStatus",
              }
-        return self.call_snapserver_jsonrcp(payload)
+        return self.call_snapserver_jsonrcp(payload, object_hook=parse_status_object)["server"]
 
     def get_status(self):
-        logging.info("Getting snapclient status")
+        logger.info("Getting snapclient status")
         payload = \
             {"id": REQ_TAG_GET_STATUS,
              "jsonrpc": "2.0",
@@ -48,15 +61,15 @@ class SnapcastRpcWrapper:
         return self.call_snapserver_jsonrcp(payload)
 
     def unmute(self):
-        logging.info("Unmuting snapclient")
+        logger.info("Unmuting snapclient")
         self.set_muted(False)
 
     def mute(self):
-        logging.info("Muting snapclient")
+        logger.info("Muting snapclient")
         self.set_muted(True)
 
     def set_muted(self, is_muted):
-        logging.debug("Setting snapclient mute to " + str(is_muted))
+        logger.debug("Setting snapclient mute to %s", is_muted)
         payload = \
             {"id": REQ_TAG_SET_MUTE,
              "jsonrpc": "2.0",
@@ -67,7 +80,7 @@ class SnapcastRpcWrapper:
         self.call_snapserver_jsonrcp(payload)
 
     def set_volume(self, volume_level):
-        logging.info("Setting snapclient volume level to " + str(volume_level))
+        logger.info("Setting snapclient volume level to %s", volume_level)
         volume_level = min(volume_level, 100)
         volume_level = max(volume_level, 0)
         payload = \
@@ -79,8 +92,42 @@ class SnapcastRpcWrapper:
                   "volume": {"percent": volume_level}}}
         self.call_snapserver_jsonrcp(payload)
 
+    def set_client_volumes(self, volumes):
+        """
+        Set the volume of several clients in one batch request
+
+        :param volumes: volume level per client id
+        """
+        logger.info("Setting the volume of %d snapclients", len(volumes))
+        payloads = []
+        for client_id, volume_level in volumes.items():
+            payloads.append(
+                {"jsonrpc": "2.0",
+                 "method": "Client.SetVolume",
+                 "params":
+                     {"id": client_id,
+                      "volume": {"percent": max(min(int(volume_level), 100), 0)}}})
+        self.call_snapserver_jsonrcp_batch(payloads)
+
+    def set_client_mutes(self, mutes):
+        """
+        Mute or unmute several clients in one batch request
+
+        :param mutes: mute status per client id
+        """
+        logger.info("Setting the mute status of %d snapclients", len(mutes))
+        payloads = []
+        for client_id, is_muted in mutes.items():
+            payloads.append(
+                {"jsonrpc": "2.0",
+                 "method": "Client.SetVolume",
+                 "params":
+                     {"id": client_id,
+                      "volume": {"muted": bool(is_muted)}}})
+        self.call_snapserver_jsonrcp_batch(payloads)
+
     def set_name(self, name):
-        logging.info("Setting snapclient name to " + name)
+        logger.info("Setting snapclient name to " + name)
         payload = \
             {"id": REQ_TAG_SET_NAME,
              "jsonrpc": "2.0",
@@ -91,72 +138,124 @@ class SnapcastRpcWrapper:
         self.call_snapserver_jsonrcp(payload)
 
     def set_latency(self, latency):
-        logging.info("Setting snapclient latency to " + latency)
+        logger.info("Setting snapclient latency to %s ms", latency)
         payload = \
             {"id": REQ_TAG_SET_LATENCY,
              "jsonrpc": "2.0",
-             "method": "Client.SetName",
+             "method": "Client.SetLatency",
              "params": {"id": self.client_id,
-                        "latency": latency}
+                        "latency": int(latency)}
              }
         self.call_snapserver_jsonrcp(payload)
 
+    def ping(self):
+        """
+        Measure the round trip time of a cheap RPC call, in seconds
+        """
+        payload = {"id": REQ_TAG_GET_SERVER_RPC_VERSION,
+                   "jsonrpc": "2.0",
+                   "method": "Server.GetRPCVersion"}
+        started = time.perf_counter()
+        self.call_snapserver_jsonrcp(payload, timeout=PING_TIMEOUT)
+        return time.perf_counter() - started
+
+    def control_stream(self, stream_id, command, params=None):
+        logger.info("Sending %s to stream %s", command, stream_id)
+        payload = \
+            {"id": REQ_TAG_STREAM_CONTROL,
+             "jsonrpc": "2.0",
+             "method": "Stream.Control",
+             "params": {"id": stream_id,
+                        "command": command}
+             }
+        if params is not None:
+            payload["params"]["params"] = params
+        return self.call_snapserver_jsonrcp(payload)
+
     def verify_srver_rpc_version(self):
         payload = {"id": REQ_TAG_GET_SERVER_RPC_VERSION,
                    "jsonrpc": "2.0",
                    "method": "Server.GetRPCVersion"}
         result = self.call_snapserver_jsonrcp(payload)
         # Result: {"major":2,"minor":0,"patch":0}
-        logging.info(f"Snapserver RPC version is {result['major']}.{result['minor']}.{result['major']}")
+        logger.info(f"Snapserver RPC version is {result['major']}.{result['minor']}.{result['major']}")
         if result['major'] != 2:
-            logging.warning("Snapserver uses a JsonRPC version different from v2")
-            logging.warning("Snapserver RPC calls might cause unexpected behaviour")
-            logging.warning("Update Snapserver to resolve this")
+            logger.warning("Snapserver uses a JsonRPC version different from v2")
+            logger.warning("Snapserver RPC calls might cause unexpected behaviour")
+            logger.warning("Update Snapserver to resolve this")
+
+    def call_snapserver_jsonrcp(self, payload_data, object_hook=None, timeout=None):
+        logger.debug("Sending JsonRPC call %s to Snapserver at %s", payload_data["method"], self.server_address)
+        with self.flight_recorder.stage("rpc:" + payload_data["method"]):
+            response = requests.post(self.jsonrpc_url, json=payload_data, timeout=timeout)
+        if logger.isEnabledFor(logging.DEBUG):
+            # Decoding the response text is expensive for large responses
+            logger.debug("JsonRCP response: %s", response.text)
+        return response.json(object_hook=object_hook)['result']
 
-    def call_snapserver_jsonrcp(self, payload_data):
-        logging.debug("Sending JsonRPC call to Snapserver at " + self.server_address)
-        response = requests.post('http://' + self.server_address + ":" + str(self.server_control_port) +"/jsonrpc", json=payload_data)
-        logging.debug("JsonRCP response: " + response.text)
-        return response.json()['result']
+    def call_snapserver_jsonrcp_batch(self, payloads):
+        """
+        Send several calls in one JSON-RPC batch request, so they cost a
+        single round trip. The request ids are assigned here.
+
+        :return: the results in the order of the payloads, None for failed calls
+        """
+        if not payloads:
+            return []
+        for request_id, payload in enumerate(payloads):
+            payload["id"] = request_id
+        logger.debug("Sending %d batched JsonRPC calls to Snapserver at %s", len(payloads), self.server_address)
+        with self.flight_recorder.stage("rpc:batch"):
+            response = requests.post(self.jsonrpc_url, json=payloads)
+        responses = {result.get("id"): result for result in response.json()}
+        results = []
+        for payload in payloads:
+            result = responses.get(payload["id"], {})
+            if "error" in result or "result" not in result:
+                logger.error("JsonRPC call %s for %s failed: %s", payload["method"], payload["params"].get("id"),
+                             result.get("error", "no response"))
+            results.append(result.get("result"))
+        return results
 
     def get_client_id(self):
-        logging.info("Finding MAC address of active interface to use as snapclient id")
+        logger.info("Finding MAC address of active interface to use as snapclient id")
         addresses = list()
         for interface in listdir("/sys/class/net/"):
             if interface == "lo":
                 continue
             try:
-                status = open('/sys/class/net/' + interface + '/operstate').readline()
-                logging.info(f"Status for interface {interface}: {status.strip()}")
+                with open('/sys/class/net/' + interface + '/operstate') as operstate:
+                    status = operstate.readline()
+                logger.info(f"Status for interface {interface}: {status.strip()}")
                 if status == "down":
                     continue
-                mac = open('/sys/class/net/' + interface + '/address').readline()
-                logging.info(f"MAC address for interface {interface}: {mac[0:17]}")
+                with open('/sys/class/net/' + interface + '/address') as address:
+                    mac = address.readline()
+                logger.info(f"MAC address for interface {interface}: {mac[0:17]}")
                 addresses.append(mac[0:17])
             except:
                 pass
 
         if len(addresses) == 0:
-            logging.critical("Failed to find MAC address of active network adapter")
+            logger.critical("Failed to find MAC address of active network adapter")
             exit(1)
         elif len(addresses) == 1:
-            logging.info("Single MAC address: " + addresses[0])
+            logger.info("Single MAC address: " + addresses[0])
             return addresses[0]
         else:
-            logging.info("Multiple MAC addresses, determining id")
-            snapcast_clients = dict()
-            response = self.get_server_status()
-            for group in response['server']['groups']:
-                for client in group['clients']:
-                    if not client['connected']:
-                        logging.info("Client " + client['id'] + " is currently disconnected"
-                                     + " (was connected to " + group['stream_id'] + ")")
+            logger.info("Multiple MAC addresses, determining id")
+            connected_clients = set()
+            status = self.get_server_status()
+            for group in status.groups:
+                for client in group.clients:
+                    if not client.connected:
+                        logger.info("Client %s is currently disconnected (was connected to %s)",
+                                    client.id, group.stream_id)
                         continue
-                    logging.info(
-                        "Client " + client['id'] + " is connected to stream " + group['stream_id'])
-                    snapcast_clients[client['id']] = group['stream_id']
+                    logger.info("Client %s is connected to stream %s", client.id, group.stream_id)
+                    connected_clients.add(client.id)
 
             for address in addresses:
-                if address in snapcast_clients.keys():
-                    logging.info("Found mac address registered in snapserver: " + address)
+                if address in connected_clients:
+                    logger.info("Found mac address registered in snapserver: %s", address)
                     return address
@@ -0,0 +1,140 @@
+import ipaddress
+import logging
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zeroconf import Zeroconf, IPVersion
+
+logger = logging.getLogger(__name__)
+
+ZEROCONF_SERVICE_TYPE = "_snapcast._tcp.local."
+ZEROCONF_SERVICE_NAME = "Snapcast._snapcast._tcp.local."
+DEFAULT_STREAM_PORT = 1704
+
+
+def format_host(address, escape_scope=True):
+    """
+    Format an address for use in a URL, IPv6 addresses need brackets
+
+    :param escape_scope: escape the % of a scoped IPv6 address as RFC 6874
+        requires, websocket-client only understands it unescaped
+    """
+    if ":" in address:
+        if escape_scope:
+            address = address.replace("%", "%25")
+        return "[" + address + "]"
+    return address
+
+
+def is_link_local(address):
+    return ipaddress.ip_address(address.split("%")[0]).is_link_local
+
+
+def get_zeroconf_service_info(timeout=3000):
+    zerocfg = Zeroconf()
+    try:
+        return zerocfg.get_service_info(ZEROCONF_SERVICE_TYPE, ZEROCONF_SERVICE_NAME, timeout)
+    finally:
+        zerocfg.close()
+
+
+def get_advertised_addresses(service_info):
+    """
+    All usable IPv4 and IPv6 addresses snapserver advertises
+    """
+    try:
+        # Keeps the interface of link-local IPv6 addresses, zeroconf >= 0.32
+        all_addresses = service_info.parsed_scoped_addresses(IPVersion.All)
+    except AttributeError:
+        all_addresses = service_info.parsed_addresses(IPVersion.All)
+    addresses = []
+    for address in all_addresses:
+        if ipaddress.ip_address(address.split("%")[0]).is_unspecified:
+            continue
+        addresses.append(address)
+    return addresses
+
+
+def prefer_routable(addresses):
+    """
+    Drop link-local addresses if there is a routable one: they only work
+    through a single interface
+
+    :return: the addresses worth ranking
+    """
+    routable = [address for address in addresses if not is_link_local(address)]
+    return routable or addresses
+
+
+def measure_connect_latency(address, port, timeout):
+    """
+    :return: the time it takes to connect to address in seconds, None if it's unreachable
+    """
+    started = time.perf_counter()
+    try:
+        connection = socket.create_connection((address, port), timeout)
+    except OSError as e:
+        logger.debug("Snapserver address %s is unreachable: %s", address, e)
+        return None
+    latency = time.perf_counter() - started
+    connection.close()
+    return latency
+
+
+def rank_addresses(addresses, port, timeout=1.0):
+    """
+    Probe all addresses at the same time
+
+    :return: reachable addresses with their connect latency, fastest first
+    """
+    if not addresses:
+        return []
+    with ThreadPoolExecutor(max_workers=len(addresses)) as executor:
+        latencies = list(executor.map(lambda address: measure_connect_latency(address, port, timeout), addresses))
+    ranking = sorted((latency, address) for latency, address in zip(latencies, addresses) if latency is not None)
+    for latency, address in ranking:
+        logger.info("Snapserver address %s connects in %.1f ms", address, latency * 1000)
+    return [(address, latency) for latency, address in ranking]
+
+
+def discover_server(configured_address=None):
+    """
+    Find snapserver through zeroconf.
+
+    When no address is configured, the fastest reachable advertised address
+    is used, link-local ones only if no routable address is advertised. The streaming port is only taken from zeroconf if the address
+    belongs to the advertised server.
+
+    :return: (server address, streaming port), the address is None if no server was found
+    """
+    service_info = get_zeroconf_service_info()
+    if service_info is None:
+        if configured_address is None:
+            logger.error("Failed to obtain snapserver address through zeroconf!")
+        else:
+            logger.warning("Failed to obtain snapserver streaming port through zeroconf!")
+        return configured_address, DEFAULT_STREAM_PORT
+    logger.debug(service_info)
+
+    addresses = get_advertised_addresses(service_info)
+    if configured_address is not None:
+        if configured_address not in addresses:
+            logger.warning("Configured snapserver %s is not the one advertised through zeroconf (%s), "
+                           "using the default streaming port", configured_address, ", ".join(addresses))
+            return configured_address, DEFAULT_STREAM_PORT
+        logger.info("Obtained snapserver streaming port through zeroconf: %d", service_info.port)
+        return configured_address, service_info.port
+
+    if not addresses:
+        logger.critical("Failed to obtain snapserver address through zeroconf, got only unspecified addresses!")
+        logger.error(service_info)
+        return None, DEFAULT_STREAM_PORT
+
+    ranking = rank_addresses(prefer_routable(addresses), service_info.port)
+    if not ranking:
+        logger.error("None of the snapserver addresses is reachable: %s", ", ".join(addresses))
+        return None, DEFAULT_STREAM_PORT
+    snapserver_address = ranking[0][0]
+    logger.info("Obtained snapserver address through zeroconf: %s, streaming port %d",
+                snapserver_address, service_info.port)
+    return snapserver_address, service_info.port
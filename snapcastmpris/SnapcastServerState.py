@@ -0,0 +1,157 @@
+import logging
+import threading
+from snapcastmpris.SnapcastModels import SnapcastServer, SnapcastClient, SnapcastStream, parse_status_tree
+
+logger = logging.getLogger(__name__)
+
+
+def diff_entities(old, new):
+    """
+    Compare two {id: {field: value}} mappings
+
+    :return: the changed fields per id, None for removed ids
+    """
+    diff = {}
+    for entity_id, fields in new.items():
+        old_fields = old.get(entity_id)
+        if old_fields is None:
+            diff[entity_id] = fields
+            continue
+        changed = {key: value for key, value in fields.items() if old_fields.get(key) != value}
+        if changed:
+            diff[entity_id] = changed
+    for entity_id in old:
+        if entity_id not in new:
+            diff[entity_id] = None
+    return diff
+
+
+class SnapcastServerState:
+    """
+    In-memory copy of the groups, clients and streams on snapserver, kept up
+    to date by the notifications snapserver sends over the websocket.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.server = SnapcastServer()
+        # Set when a notification refers to something unknown, the full
+        # status has to be requested again
+        self.stale = True
+
+    def load(self, server: SnapcastServer):
+        """
+        Replace the whole state
+
+        :return: the difference with the previous state
+        """
+        with self.lock:
+            old = self.server.to_json()
+            self.server = server
+            self.stale = False
+            return self.diff(old, server.to_json())
+
+    @staticmethod
+    def diff(old, new):
+        diff = {}
+        for kind in ("groups", "clients", "streams"):
+            changed = diff_entities(old[kind], new[kind])
+            if changed:
+                diff[kind] = changed
+        return diff
+
+    def snapshot(self):
+        with self.lock:
+            return self.server.to_json()
+
+    def get_client(self, client_id):
+        with self.lock:
+            client = self.server.get_client(client_id)
+            return client.to_json() if client is not None else {}
+
+    def get_stream(self, stream_id):
+        with self.lock:
+            stream = self.server.get_stream(stream_id)
+            return stream.to_json() if stream is not None else {}
+
+    def get_group_of_client(self, client_id):
+        with self.lock:
+            return self.server.get_group_of_client(client_id)
+
+    def get_group_volumes(self, client_id):
+        """
+        :return: {client id: volume} of all clients in the group of client_id
+        """
+        with self.lock:
+            group = self.server.get_group_of_client(client_id)
+            if group is None:
+                return {}
+            return {client.id: client.volume for client in group.clients}
+
+    def apply_notification(self, method, params):
+        """
+        Apply a snapserver notification
+
+        :return: the resulting changes, empty if nothing changed
+        """
+        if method == "Server.OnUpdate":
+            return self.load(parse_status_tree(params["server"]))
+
+        with self.lock:
+            kind, entity = self.find_entity(method, params)
+            if entity is None:
+                return {}
+            before = entity.to_json()
+            self.apply(method, params, entity)
+            changes = {key: value for key, value in entity.to_json().items() if before[key] != value}
+            if not changes:
+                return {}
+            return {kind: {entity.id: changes}}
+
+    def find_entity(self, method, params):
+        if method.startswith("Client."):
+            client = self.server.get_client(params["id"])
+            if client is None and method == "Client.OnConnect":
+                logger.debug("Unknown client %s connected", params["id"])
+                self.stale = True
+            return "clients", client
+        if method.startswith("Group."):
+            group = self.server.get_group(params["id"])
+            if group is None:
+                self.stale = True
+            return "groups", group
+        if method == "Stream.OnUpdate":
+            stream = self.server.get_stream(params["id"])
+            if stream is None:
+                # Snapserver doesn't announce new streams separately
+                stream = SnapcastStream(params["id"], None)
+                self.server.streams.append(stream)
+            return "streams", stream
+        return None, None
+
+    @staticmethod
+    def apply(method, params, entity):
+        if method == "Client.OnVolumeChanged":
+            entity.volume = params["volume"].get("percent", entity.volume)
+            entity.muted = params["volume"].get("muted", entity.muted)
+        elif method == "Client.OnConnect":
+            updated = SnapcastClient.from_json(params["client"])
+            entity.name = updated.name
+            entity.volume = updated.volume
+            entity.muted = updated.muted
+            entity.latency = updated.latency
+            entity.connected = True
+        elif method == "Client.OnDisconnect":
+            entity.connected = False
+        elif method == "Client.OnLatencyChanged":
+            entity.latency = params["latency"]
+        elif method == "Client.OnNameChanged":
+            entity.name = params["name"]
+        elif method == "Group.OnMute":
+            entity.muted = params["mute"]
+        elif method == "Group.OnStreamChanged":
+            entity.stream_id = params["stream_id"]
+        elif method == "Group.OnNameChanged":
+            entity.name = params["name"]
+        elif method == "Stream.OnUpdate":
+            entity.status = params["stream"].get("status", entity.status)
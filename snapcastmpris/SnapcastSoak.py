@@ -0,0 +1,315 @@
+"""
+Soak test of SnapcastWrapper: feeds days of synthetic events at high speed
+and watches the memory, threads and open files of the process.
+
+The real wrapper runs with its command worker, ALSA poll thread,
+snapclient output reader, adaptive buffer controller, SnapcastRpcWrapper
+and reconnecting SnapcastRpcWebsocketWrapper. They talk to a fake
+snapserver in a child process, so its threads and sockets don't count. The
+ALSA mixer is replaced by one that holds a pipe like a real mixer holds its
+device, snapclient by a small process that reports underruns. Only D-Bus
+is a stub.
+"""
+
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import random
+import select
+import signal
+import sys
+import threading
+import time
+import urllib.request
+import weakref
+
+from snapcastmpris.SnapcastWrapper import SnapcastWrapper
+from snapcastmpris.SnapcastFakeServer import FakeSnapserver, read_client_ids
+from snapcastmpris.SnapcastServerDiscovery import get_zeroconf_service_info
+from snapcastmpris.SnapcastTraceReplay import ReplayStub, DBUS_METHODS
+from snapcastmpris.SnapcastTraceRecorder import TRACE_WEBSOCKET, TRACE_DBUS, TRACE_ALSA, TRACE_SNAPCLIENT
+
+logger = logging.getLogger(__name__)
+
+# Soak only events
+SOAK_WEBSOCKET_DROP = "ws_drop"
+SOAK_CLIENT_ID = "client_id"
+SOAK_DISCOVERY = "discovery"
+# Synthetic events per simulated hour
+SOAK_EVENTS_PER_HOUR = 720
+# Resource usage samples taken during a run, the first tenth is warm-up
+SOAK_SAMPLES = 50
+# Growth is measured between the lowest of this many samples after the
+# warm-up and at the end, so threads that are just exiting don't count
+SOAK_SAMPLE_WINDOW = 5
+# Times the thread and fd counts are read until they are stable before a sample
+SOAK_SETTLE_CHECKS = 20
+SOAK_OTHER_CLIENTS = ["00:00:00:00:00:02", "00:00:00:00:00:03", "00:00:00:00:00:04"]
+SOAK_STREAMS = ["default", "spotify", "airplay", "radio"]
+# Stands in for snapclient and ignores its arguments. A single process like
+# snapclient, a shell would leave a child holding the output pipe when killed
+SOAK_SNAPCLIENT = [sys.executable, "-c",
+                   "import time\nwhile True:\n    time.sleep(0.05)\n    print('underrun', flush=True)"]
+
+class SoakMixer:
+    """
+    ALSA mixer that holds a pipe like a real mixer holds its device, until
+    it is closed
+    """
+
+    def __init__(self, name):
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+        SoakAlsa.mixers.add(self)
+
+    def polldescriptors(self):
+        return [(self.read_fd, select.POLLIN)]
+
+    def handleevents(self):
+        try:
+            while os.read(self.read_fd, 64):
+                pass
+        except BlockingIOError:
+            pass
+
+    def getvolume(self, direction):
+        return [SoakAlsa.volume]
+
+    def setvolume(self, volume, channel, direction):
+        SoakAlsa.set_volume(volume)
+
+    def signal(self):
+        try:
+            os.write(self.write_fd, b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def close(self):
+        SoakAlsa.mixers.discard(self)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+class SoakAlsa:
+    """
+    Stands in for the alsaaudio module
+    """
+
+    Mixer = SoakMixer
+    PCM_PLAYBACK = 0
+    MIXER_CHANNEL_ALL = -1
+    volume = 50
+    mixers = weakref.WeakSet()
+
+    @classmethod
+    def set_volume(cls, volume):
+        # Like ALSA, every open mixer sees the change
+        cls.volume = volume
+        for mixer in list(cls.mixers):
+            mixer.signal()
+
+
+class SoakSnapcastWrapper(SnapcastWrapper):
+
+    snapclient_command = SOAK_SNAPCLIENT
+
+    def __init__(self, port):
+        super().__init__(None, "127.0.0.1", sync_volume=True, adaptive_buffer=True, server_control_port=port)
+        # Drops are simulated often, a reconnect doesn't need to wait long
+        self.websocket_wrapper.reconnect_interval = 0.05
+
+    def load_alsa(self):
+        return SoakAlsa
+
+    def create_dbus_service(self, glib_loop):
+        return ReplayStub("dbus")
+
+    def wait_for_snapclient_registration(self, delay=2):
+        pass
+
+    def pause_other_players(self):
+        pass
+
+
+def generate_soak_events(hours, client_id, seed=0):
+    """
+    Generate random volume changes, stream starts and stops, D-Bus calls,
+    snapclient crashes, websocket drops, client id lookups and zeroconf
+    discoveries
+
+    :param hours: simulated time
+    """
+    rng = random.Random(seed)
+
+    def notification(method, params):
+        return {"k": TRACE_WEBSOCKET, "d": json.dumps({"jsonrpc": "2.0", "method": method, "params": params})}
+
+    def volume_changed(volume_client_id):
+        return notification("Client.OnVolumeChanged",
+                            {"id": volume_client_id, "volume": {"percent": rng.randint(0, 100), "muted": False}})
+
+    def stream_update(status):
+        stream_id = rng.choice(SOAK_STREAMS)
+        return notification("Stream.OnUpdate", {"id": stream_id, "stream": {"id": stream_id, "status": status}})
+
+    def stream_properties():
+        return notification("Stream.OnProperties",
+                            {"id": rng.choice(SOAK_STREAMS),
+                             "properties": {"position": rng.uniform(0, 300), "playbackStatus": "playing",
+                                            "canSeek": rng.random() < 0.5, "canGoNext": True,
+                                            "metadata": {"title": "Track {}".format(rng.randint(0, 10000))}}})
+
+    generators = [
+        (8, lambda: {"k": TRACE_ALSA, "d": rng.randint(0, 100)}),
+        (6, lambda: volume_changed(client_id)),
+        (4, lambda: volume_changed(rng.choice(SOAK_OTHER_CLIENTS))),
+        (4, lambda: stream_update("playing")),
+        (4, lambda: stream_update("idle")),
+        (6, stream_properties),
+        (4, lambda: {"k": TRACE_DBUS, "d": [rng.choice(["Play", "Pause", "PlayPause", "Stop"])]}),
+        (2, lambda: {"k": TRACE_SNAPCLIENT, "d": "died"}),
+        (2, lambda: {"k": SOAK_WEBSOCKET_DROP, "d": None}),
+        (1, lambda: {"k": SOAK_CLIENT_ID, "d": None}),
+        (1, lambda: {"k": SOAK_DISCOVERY, "d": None}),
+    ]
+    weights = [weight for weight, _ in generators]
+    for index in range(int(hours * SOAK_EVENTS_PER_HOUR)):
+        event = rng.choices(generators, weights)[0][1]()
+        event["t"] = (index + 1) * 3600 / SOAK_EVENTS_PER_HOUR
+        yield event
+
+
+class SoakRun:
+
+    def __init__(self):
+        client_ids = read_client_ids()
+        self.server = FakeSnapserver(client_ids + SOAK_OTHER_CLIENTS, SOAK_STREAMS)
+        self.port = self.server.server_address[1]
+        # The server runs in a child process, its resources are not measured
+        self.server_process = multiprocessing.get_context("fork").Process(target=self.server.serve_forever, daemon=True)
+        self.server_process.start()
+        self.server.server_close()
+        self.wrapper = SoakSnapcastWrapper(self.port)
+
+    def control(self, command):
+        request = urllib.request.Request("http://127.0.0.1:{}/control".format(self.port),
+                                         data=json.dumps(command).encode(),
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+    def apply(self, event):
+        kind = event["k"]
+        if kind == TRACE_WEBSOCKET:
+            self.control({"notification": event["d"]})
+        elif kind == TRACE_ALSA:
+            SoakAlsa.set_volume(event["d"])
+        elif kind == TRACE_DBUS:
+            self.wrapper.submit_command("dbus", event["d"][0], DBUS_METHODS[event["d"][0]], self.wrapper)
+        elif kind == TRACE_SNAPCLIENT:
+            snapclient = self.wrapper.snapclient
+            if snapclient is not None:
+                try:
+                    os.kill(snapclient.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        elif kind == SOAK_WEBSOCKET_DROP:
+            self.control({"drop": True})
+        elif kind == SOAK_CLIENT_ID:
+            self.wrapper.rpc_wrapper.get_client_id()
+        elif kind == SOAK_DISCOVERY:
+            get_zeroconf_service_info(timeout=50)
+
+    def wait_for_worker(self):
+        done = threading.Event()
+        self.wrapper.submit_command("soak", "barrier", done.set)
+        done.wait(10)
+
+    def read_stopped_usage(self):
+        """
+        Stop playback and wait for the threads of the killed snapclient to
+        exit, so all samples are taken in the same state
+        """
+        self.wrapper.submit_command("soak", "Stop", DBUS_METHODS["Stop"], self.wrapper)
+        self.wait_for_worker()
+        gc.collect()
+        usage = read_resource_usage()
+        for _ in range(SOAK_SETTLE_CHECKS):
+            time.sleep(0.05)
+            previous, usage = usage, read_resource_usage()
+            if usage[1:] == previous[1:]:
+                break
+        return usage
+
+    def run(self, hours, seed=0):
+        """
+        :return: (samples as (simulated hours, rss, threads, fds), errors)
+        """
+        self.wrapper.start()
+        total = int(hours * SOAK_EVENTS_PER_HOUR)
+        interval = max(total // SOAK_SAMPLES, 1)
+        samples = []
+        errors = 0
+        try:
+            for index, event in enumerate(generate_soak_events(hours, self.wrapper.rpc_wrapper.client_id, seed)):
+                try:
+                    self.apply(event)
+                except Exception as e:
+                    errors += 1
+                    logger.debug("Soak event %s failed: %r", event, e)
+                self.wait_for_worker()
+                if index % interval == 0 or index == total - 1:
+                    samples.append((event["t"] / 3600,) + self.read_stopped_usage())
+        finally:
+            self.stop()
+        return samples, errors
+
+    def stop(self):
+        self.wrapper.stop()
+        self.wrapper.join()
+        if self.wrapper.snapclient is not None:
+            self.wrapper.snapclient.kill()
+            self.wrapper.snapclient.wait()
+        self.server_process.terminate()
+        self.server_process.join()
+
+
+def read_resource_usage():
+    """
+    :return: (resident memory in bytes, threads, open file descriptors) of this process
+    """
+    with open("/proc/self/statm") as statm:
+        rss = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return rss, len(os.listdir("/proc/self/task")), len(os.listdir("/proc/self/fd"))
+
+
+def soak(hours, seed=0):
+    return SoakRun().run(hours, seed)
+
+
+def print_soak_report(samples, errors, max_rss_growth, max_thread_growth, max_fd_growth):
+    """
+    :return: True if the growth after the warm-up stayed within the limits
+    """
+    print("{:>10} {:>10} {:>8} {:>6}".format("hours", "RSS KiB", "threads", "fds"))
+    for hours, rss, threads, fds in samples:
+        print("{:10.1f} {:10d} {:8d} {:6d}".format(hours, rss // 1024, threads, fds))
+
+    warm = min(len(samples) // 10, max(len(samples) - SOAK_SAMPLE_WINDOW, 0))
+    baseline = [min(sample[column] for sample in samples[warm:warm + SOAK_SAMPLE_WINDOW]) for column in (1, 2, 3)]
+    last = [min(sample[column] for sample in samples[-SOAK_SAMPLE_WINDOW:]) for column in (1, 2, 3)]
+    growth = [value - base for value, base in zip(last, baseline)]
+    print()
+    print("Growth after warm-up: {} KiB RSS, {} threads, {} fds, {} failed events".format(
+        growth[0] // 1024, growth[1], growth[2], errors))
+    passed = True
+    for name, value, limit in (("RSS", growth[0], max_rss_growth * 1024 * 1024),
+                               ("thread", growth[1], max_thread_growth),
+                               ("fd", growth[2], max_fd_growth)):
+        if value > limit:
+            print("FAILED: {} growth {} exceeds the limit of {}".format(name, value, limit))
+            passed = False
+    return passed
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Longest time a long-poll request may wait for a change, in seconds
+MAX_WAIT = 300
+# Interval of keep-alive comments on the event stream, in seconds
+EVENT_KEEPALIVE = 15
+
+
+class SnapcastStatusHandler(BaseHTTPRequestHandler):
+    """
+    GET /status returns the current state as JSON with an ETag. With
+    If-None-Match and ?wait=<seconds>, the request only returns when the
+    state has changed or the time is up (304). GET /events streams every
+    new state as server-sent events.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/status":
+            self.send_status(parse_qs(url.query))
+        elif url.path == "/events":
+            self.send_events()
+        else:
+            self.send_error(404)
+
+    def send_status(self, query):
+        status = self.server.status
+        version, body = status.get_snapshot()
+        if self.headers.get("If-None-Match") == status.etag(version):
+            try:
+                wait = min(float(query.get("wait", ["0"])[0]), MAX_WAIT)
+            except ValueError:
+                wait = 0
+            version, body = status.wait_for_change(version, wait)
+            if self.headers.get("If-None-Match") == status.etag(version):
+                self.send_response(304)
+                self.send_header("ETag", status.etag(version))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", status.etag(version))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self):
+        status = self.server.status
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        version, body = status.get_snapshot()
+        try:
+            while status.running:
+                self.wfile.write(b"id: " + str(version).encode() + b"\ndata: " + body + b"\n\n")
+                self.wfile.flush()
+                while status.running:
+                    new_version, body = status.wait_for_change(version, EVENT_KEEPALIVE)
+                    if new_version != version:
+                        version = new_version
+                        break
+                    self.wfile.write(b": keep-alive\n\n")
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def address_string(self):
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "local"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class SnapcastThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+class SnapcastStatusServer(threading.Thread):
+    """
+    Serves the playback state to local observers over HTTP on localhost or a
+    Unix socket. All requests share one encoded snapshot per state version,
+    which is only built again after notify_changed.
+    """
+
+    def __init__(self, get_status, port=None, socket_path=None):
+        super().__init__()
+        self.name = "SnapcastStatusServer"
+        self.get_status = get_status
+        self.condition = threading.Condition()
+        self.version = 0
+        self.snapshot = None
+        self.running = True
+        # Versions start at 0 again after a restart, the nonce keeps an ETag
+        # of the previous process from matching
+        self.nonce = os.urandom(4).hex()
+
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.httpd = SnapcastThreadingUnixHTTPServer(socket_path, SnapcastStatusHandler)
+            logger.info("Serving status on %s", socket_path)
+        else:
+            self.httpd = ThreadingHTTPServer(("127.0.0.1", port), SnapcastStatusHandler)
+            self.httpd.daemon_threads = True
+            logger.info("Serving status on http://127.0.0.1:%d/status", port)
+        self.httpd.status = self
+
+    def etag(self, version):
+        return '"{}-{}"'.format(self.nonce, version)
+
+    def notify_changed(self):
+        with self.condition:
+            self.version += 1
+            self.snapshot = None
+            self.condition.notify_all()
+
+    def get_snapshot(self):
+        with self.condition:
+            if self.snapshot is None:
+                self.snapshot = (self.version, json.dumps(self.get_status()).encode("utf-8"))
+            return self.snapshot
+
+    def wait_for_change(self, version, timeout):
+        """
+        Wait until the state is newer than version, or the timeout expired
+
+        :return: the current (version, body)
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version or not self.running, timeout)
+        return self.get_snapshot()
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,71 @@
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TRACE_INIT = "init"
+TRACE_WEBSOCKET = "ws"
+TRACE_DBUS = "dbus"
+TRACE_ALSA = "alsa"
+TRACE_SNAPCLIENT = "snapclient"
+
+
+class SnapcastTraceRecorder:
+    """
+    Appends timestamped events to a trace file, so the sequence of events
+    that led to a problem can be replayed with snapcastmpris-replay.
+
+    Every event is written as one compact JSON document per line:
+    {"t": <seconds since start>, "k": <kind>, "d": <data>}
+    Recording is disabled when no path is given.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.file = None
+        if path is not None:
+            # Line buffered, so a crash loses at most the event being written
+            self.file = open(path, "a", buffering=1, encoding="utf-8")
+            logger.info("Recording event trace to " + path)
+
+    @property
+    def enabled(self):
+        return self.file is not None
+
+    def record(self, kind, data=None):
+        if self.file is None:
+            return
+        line = json.dumps({"t": round(time.monotonic() - self.start_time, 6),
+                           "k": kind,
+                           "d": data},
+                          separators=(",", ":"))
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_trace(path):
+    """
+    Read a trace file and split it in sessions, each starting with an
+    init event
+    """
+    sessions = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["k"] == TRACE_INIT or not sessions:
+                sessions.append([])
+            sessions[-1].append(event)
+    return sessions
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replays a trace recorded with snapcastmpris --trace against the real
+SnapcastWrapper and SnapcastRpcWebsocketWrapper logic. snapclient,
+snapserver RPC calls and D-Bus are replaced by stubs, so this can run next
+to a running snapcastmpris instance or on a development machine.
+
+In soak mode, days of synthetic events are fed to a wrapper running
+against a fake snapserver, see SnapcastSoak.
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import collections
+
+from snapcastmpris.SnapcastWrapper import SnapcastWrapper
+from snapcastmpris.SnapcastRpcWebsocketWrapper import SnapcastRpcWebsocketWrapper
+from snapcastmpris.SnapcastTraceRecorder import read_trace, TRACE_INIT, TRACE_WEBSOCKET, TRACE_DBUS, TRACE_ALSA, \
+    TRACE_SNAPCLIENT
+
+logger = logging.getLogger(__name__)
+
+# D-Bus methods, as dispatched by SnapcastMPRISInterface
+DBUS_METHODS = {
+    "Play": lambda wrapper: wrapper.start_playback(),
+    "Pause": lambda wrapper: wrapper.pause_playback(),
+    "PlayPause": lambda wrapper: wrapper.toggle_playback(),
+    "Stop": lambda wrapper: wrapper.stop_playback(),
+    "Next": lambda wrapper: wrapper.next_track(),
+    "Previous": lambda wrapper: wrapper.previous_track(),
+    "Seek": lambda wrapper, offset: wrapper.seek(offset),
+    "SetPosition": lambda wrapper, position: wrapper.set_position(position),
+    "SetClientVolumes": lambda wrapper, volumes: wrapper.set_client_volumes(volumes),
+    "SetClientMutes": lambda wrapper, mutes: wrapper.set_client_mutes(mutes),
+}
+
+
+class ReplayStub:
+    """
+    Stands in for an external dependency and counts the calls made to it
+    """
+
+    def __init__(self, name, **attributes):
+        self.stub_name = name
+        # Counts per method, a list of all calls would grow during soak runs
+        self.calls = collections.Counter()
+        self.__dict__.update(attributes)
+
+    def __getattr__(self, name):
+        def record_call(*args, **kwargs):
+            self.calls[name] += 1
+        return record_call
+
+
+class ReplayLogCounter(logging.Handler):
+    """
+    Counts the log records emitted while replaying, to measure the log volume
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.records = 0
+        self.bytes = 0
+
+    def emit(self, record):
+        self.records += 1
+        self.bytes += len(self.format(record))
+
+
+class ReplaySnapclient:
+    """
+    Stands in for the snapclient process
+    """
+
+    returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+class ReplaySnapcastWrapper(SnapcastWrapper):
+
+    def __init__(self, server_address, client_id, sync_volume):
+        self.replay_client_id = client_id
+        self.replay_volume = 0
+        super().__init__(None, server_address)
+        # Volume synchronisation works against replay_volume instead of ALSA
+        self.sync_volume = sync_volume
+        self.current_volume = self.replay_volume
+
+    def create_dbus_service(self, glib_loop):
+        return ReplayStub("dbus")
+
+    def create_rpc_wrapper(self):
+        return ReplayStub("rpc", client_id=self.replay_client_id)
+
+    def create_websocket_wrapper(self):
+        return SnapcastRpcWebsocketWrapper(
+            self.server_address,
+            self.server_control_port,
+            self.rpc_wrapper.client_id,
+            self,
+            self.trace_recorder,
+            self.flight_recorder,
+            connect=False
+        )
+
+    def wait_for_snapclient_registration(self, delay=2):
+        pass
+
+    def submit_command(self, kind, name, action, *args):
+        # There is no command worker, the replay loop is the single consumer
+        self.execute_command(kind, name, action, args, time.monotonic())
+
+    def start_snapclient_process(self):
+        self.snapclient = ReplaySnapclient()
+
+    def pause_other_players(self):
+        pass
+
+    def set_system_volume(self, volume_level):
+        self.replay_volume = volume_level
+        self.current_volume = volume_level
+
+    def get_system_volume(self):
+        return self.replay_volume
+
+
+def replay_websocket(wrapper, message):
+    wrapper.websocket_wrapper.on_ws_message(None, message)
+
+
+def replay_dbus(wrapper, call):
+    # Mirrors SnapcastMPRISInterface.run_command
+    wrapper.submit_command("dbus", call[0], DBUS_METHODS[call[0]], wrapper, *call[1:])
+
+
+def replay_alsa(wrapper, volume):
+    # Mirrors SnapcastWrapper.poll_system_volume_loop
+    wrapper.replay_volume = volume
+    wrapper.on_system_volume_change(volume)
+    wrapper.current_volume = volume
+
+
+def replay_snapclient(wrapper, lifecycle_event):
+    # Starting and killing snapclient are results of other events,
+    # only a crash is an input
+    if lifecycle_event == "died":
+        wrapper.submit_command("snapclient", "died", wrapper.on_snapclient_died)
+
+
+EVENT_HANDLERS = {
+    TRACE_WEBSOCKET: replay_websocket,
+    TRACE_DBUS: replay_dbus,
+    TRACE_ALSA: replay_alsa,
+    TRACE_SNAPCLIENT: replay_snapclient,
+}
+
+
+def describe_event(event):
+    if event["k"] == TRACE_WEBSOCKET:
+        try:
+            return json.loads(event["d"]).get("method", "response")
+        except ValueError:
+            return "invalid frame"
+    if event["k"] == TRACE_DBUS:
+        return event["d"][0]
+    if event["k"] == TRACE_ALSA:
+        return "volume"
+    return str(event["d"])
+
+
+def create_wrapper(header):
+    return ReplaySnapcastWrapper(header.get("server", "replay"),
+                                 header.get("client_id"),
+                                 header.get("sync_volume", False))
+
+
+def replay_session(session, speed):
+    """
+    Feed the events of a session to a fresh wrapper
+
+    :param speed: 1.0 replays in real time, 0 as fast as possible
+    :return: a list of (event, description, cost in seconds, log bytes, transition, error)
+    """
+    header = session[0]["d"] if session[0]["k"] == TRACE_INIT else {}
+    wrapper = create_wrapper(header)
+    log_counter = ReplayLogCounter()
+    logging.getLogger().addHandler(log_counter)
+    results = []
+    start = time.monotonic()
+    for event in session:
+        handler = EVENT_HANDLERS.get(event["k"])
+        if handler is None:
+            continue
+        if speed > 0:
+            delay = start + event["t"] / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        status_before = wrapper.playback_status
+        log_bytes = log_counter.bytes
+        error = None
+        started = time.perf_counter()
+        try:
+            handler(wrapper, event["d"])
+        except Exception as e:
+            error = e
+        cost = time.perf_counter() - started
+
+        transition = None
+        if wrapper.playback_status != status_before:
+            transition = (status_before, wrapper.playback_status)
+        results.append((event, describe_event(event), cost, log_counter.bytes - log_bytes, transition, error))
+    logging.getLogger().removeHandler(log_counter)
+    return results
+
+
+def print_report(results):
+    costs = {}
+    for event, description, cost, log_bytes, transition, error in results:
+        line = "{:10.3f}s {:10} {:24} {:8.3f} ms {:6d} log bytes".format(
+            event["t"], event["k"], description, cost * 1000, log_bytes)
+        if transition is not None:
+            line += "  {} -> {}".format(*transition)
+        if error is not None:
+            line += "  ERROR: {!r}".format(error)
+        print(line)
+        costs.setdefault((event["k"], description), []).append((cost, log_bytes))
+
+    print()
+    print("{:10} {:24} {:>6} {:>10} {:>10} {:>10} {:>10}".format(
+        "kind", "event", "count", "total ms", "mean ms", "max ms", "log bytes"))
+    for (kind, description), values in sorted(costs.items()):
+        durations = [cost for cost, _ in values]
+        print("{:10} {:24} {:6d} {:10.3f} {:10.3f} {:10.3f} {:10d}".format(
+            kind, description, len(values), sum(durations) * 1000,
+            sum(durations) / len(durations) * 1000, max(durations) * 1000,
+            sum(log_bytes for _, log_bytes in values)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='snapcastmpris-replay',
+        description='Replay an event trace recorded by snapcastmpris and report the resulting state transitions '
+                    'and the processing cost of every event.')
+    parser.add_argument('trace', type=str, nargs='?', help='trace file recorded with snapcastmpris --trace')
+    parser.add_argument('--session', default=-1, type=int,
+                        help='session in the trace file to replay, the last one by default')
+    parser.add_argument('--speed', default=0, type=float,
+                        help='replay speed, 1 is real time, 0 (default) is as fast as possible')
+    parser.add_argument('--soak', default=None, type=float, metavar='HOURS',
+                        help='instead of replaying a trace, feed random events for the given simulated time '
+                             'and fail if memory, threads or open files keep growing')
+    parser.add_argument('--max-rss-growth', default=2, type=float,
+                        help='RSS growth in MiB after the warm-up that fails a soak run, 2 by default')
+    parser.add_argument('--max-thread-growth', default=0, type=int,
+                        help='thread count growth after the warm-up that fails a soak run, 0 by default')
+    parser.add_argument('--max-fd-growth', default=0, type=int,
+                        help='open file growth after the warm-up that fails a soak run, 0 by default')
+    parser.add_argument('--seed', default=0, type=int, help='random seed of a soak run')
+    parser.add_argument('-v', '--verbose', action='store_true', help='enable verbose logging')
+    parser.add_argument('--log-level', default=None, type=str,
+                        help='log level to measure the log volume and cost at, e.g. info, without printing the log')
+    args = parser.parse_args()
+
+    if args.soak is None and args.trace is None:
+        parser.error("a trace file or --soak is required")
+
+    logging.basicConfig(
+        format='%(levelname)s: %(name)s - %(message)s',
+        level=logging.DEBUG if args.verbose else logging.WARNING)
+    if args.soak is not None:
+        if not args.verbose:
+            # Crashes and drops are expected, only report real problems
+            logging.getLogger().setLevel(logging.ERROR)
+            logging.getLogger("websocket").setLevel(logging.CRITICAL)
+            logging.getLogger("snapcastmpris.SnapcastRpcWebsocketWrapper").setLevel(logging.CRITICAL)
+        print("Soaking for {:g} simulated hours".format(args.soak))
+        from snapcastmpris.SnapcastSoak import soak, print_soak_report
+        samples, errors = soak(args.soak, args.seed)
+        if not print_soak_report(samples, errors, args.max_rss_growth, args.max_thread_growth,
+                                 args.max_fd_growth):
+            sys.exit(1)
+        return
+
+    if args.log_level is not None:
+        # Only the log counter gets the records, the report stays readable
+        logging.getLogger().handlers[0].setLevel(logging.WARNING)
+        logging.getLogger().setLevel(args.log_level.upper())
+
+    sessions = read_trace(args.trace)
+    if not sessions:
+        logger.error("Trace file %s contains no events", args.trace)
+        sys.exit(1)
+    print("Replaying session {} of {}".format(args.session % len(sessions) + 1, len(sessions)))
+    results = replay_session(sessions[args.session], args.speed)
+    print_report(results)
+    if any(error is not None for *_, error in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
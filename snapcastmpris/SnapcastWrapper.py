@@ -1,153 +1,426 @@
 import sys
+import json
 import logging
 import time
+import queue
 import threading
 import subprocess
 import select
-from zeroconf import Zeroconf, IPVersion
 from snapcastmpris.SnapcastMPRISInterface import SnapcastMPRISInterface
 from snapcastmpris.SnapcastRpcListener import SnapcastRpcListener
 from snapcastmpris.SnapcastRpcWebsocketWrapper import SnapcastRpcWebsocketWrapper
 from snapcastmpris.SnapcastRpcWrapper import SnapcastRpcWrapper
+from snapcastmpris.SnapcastPositionTracker import SnapcastPositionTracker
+from snapcastmpris.SnapcastServerDiscovery import DEFAULT_STREAM_PORT, format_host
+from snapcastmpris.SnapcastServerState import SnapcastServerState
+from snapcastmpris.SnapcastFlightRecorder import SnapcastFlightRecorder
+from snapcastmpris.SnapcastBufferController import SnapcastBufferController
+from snapcastmpris.SnapcastTraceRecorder import SnapcastTraceRecorder, TRACE_INIT, TRACE_ALSA, TRACE_SNAPCLIENT
+from snapcastmpris.SnapcastPlaybackState import SnapcastPlaybackState, PLAYBACK_STOPPED, PLAYBACK_PAUSED, \
+    PLAYBACK_PLAYING, EVENT_PLAY, EVENT_PAUSE, EVENT_STOP, EVENT_AUTOSTART, EVENT_STREAM_START, EVENT_STREAM_PAUSE, \
+    EVENT_SERVER_MUTE, EVENT_SNAPCLIENT_DIED
 
-PLAYBACK_STOPPED = "stopped"
-PLAYBACK_PAUSED = "pause"
-PLAYBACK_PLAYING = "playing"
-PLAYBACK_UNKNOWN = "unkown"
+logger = logging.getLogger(__name__)
+
+# The control port cannot be determined through zeroconf
+SNAPSERVER_CONTROL_PORT = 1780
+
+# Used to pause other players when native pausing is disabled or fails
+PAUSE_ALL_COMMAND = "/opt/hifiberry/bin/pause-all"
+
+# Minimum time between two full reloads of the server state, in seconds
+SERVER_STATE_RELOAD_INTERVAL = 10
+
+# snapclient output lines containing one of these report a buffer underrun
+SNAPCLIENT_UNDERRUN_MARKERS = ("underrun", "xrun")
+
+# Stream properties reported by snapserver and the MPRIS properties they map to
+STREAM_CAPABILITIES = {
+    "canGoNext": "CanGoNext",
+    "canGoPrevious": "CanGoPrevious",
+    "canSeek": "CanSeek",
+}
+
+
+def scale_group_volumes(volumes, reference_id, volume_level):
+    """
+    Scale the volumes of a group proportionally, like snapweb does: when
+    the reference client is turned down by a third, every client loses a
+    third of its volume, when it is turned up, every client gets the same
+    share of its remaining headroom.
+
+    :param volumes: volume per client id
+    :param reference_id: the client whose volume becomes volume_level
+    :return: the new volume per client id
+    """
+    reference = volumes[reference_id]
+    if volume_level < reference:
+        ratio = (reference - volume_level) / reference
+        return {client_id: round(volume - ratio * volume) for client_id, volume in volumes.items()}
+    if volume_level > reference:
+        ratio = (volume_level - reference) / (100 - reference)
+        return {client_id: round(volume + ratio * (100 - volume)) for client_id, volume in volumes.items()}
+    return dict(volumes)
 
 
 class SnapcastWrapper(threading.Thread, SnapcastRpcListener):
     """ Wrapper to handle snapclient
     """
 
-    def __init__(self, glib_loop, server_address: str, sync_volume=False, alsa_mixer='Softvol'):
+    # Server address, port and player options are appended
+    snapclient_command = ["/bin/snapclient", "-e"]
+
+    def __init__(self, glib_loop, server_address: str, server_streaming_port=DEFAULT_STREAM_PORT, sync_volume=False, alsa_mixer='Softvol',
+                 trace_recorder=None, flight_recorder=None, adaptive_buffer=False, buffer_bounds=(80, 400),
+                 native_pause=True, pause_command=PAUSE_ALL_COMMAND, snapclient_scheduling=None,
+                 group_control=False, server_control_port=SNAPSERVER_CONTROL_PORT):
         super().__init__()
         self.name = "SnapcastWrapper"
         self.keep_running = True
         self.server_address = server_address
-
-        self.dbus_service = SnapcastMPRISInterface(self, glib_loop)
-
-        self.playback_status = PLAYBACK_STOPPED
+        self.trace_recorder = trace_recorder or SnapcastTraceRecorder()
+        self.native_pause = native_pause
+        # Play, pause, stop and volume changes apply to all clients in our group
+        self.group_control = group_control
+        self.pause_command = pause_command
+        self.flight_recorder = flight_recorder or SnapcastFlightRecorder()
+
+        # Commands from D-Bus, snapserver, signals and snapclient crashes are
+        # all run here, so the GLib main loop never waits for them and the
+        # playback state has a single writer. The signal handlers put into it
+        # on the main thread, which may be interrupted while putting a D-Bus
+        # command: unlike queue.Queue, SimpleQueue.put is reentrant
+        self.commands = queue.SimpleQueue()
+        self.command_thread = threading.Thread(target=self.command_loop)
+        self.command_thread.name = "SnapcastWrapper command worker"
+
+        self.dbus_service = self.create_dbus_service(glib_loop)
+
+        self.playback = SnapcastPlaybackState(PLAYBACK_STOPPED)
         self.metadata = {}
         self.stream_name = ""
         self.stream_group = ""
-
-        self.server_streaming_port = self.get_zeroconf_server_stream_port()
+        self.stream_id = None
+        self.stream_track_id = None
+        self.stream_properties = {}
+        self.pending_control = None
+        self.position_tracker = SnapcastPositionTracker()
+        self.server_state = SnapcastServerState()
+        self.server_state_loaded_at = None
+        # Called without arguments whenever the state returned by get_status_snapshot changes
+        self.status_observers = []
+
+        # nice level, real-time priority, CPU affinity and I/O priority of snapclient
+        self.snapclient_scheduling = snapclient_scheduling
+        self.snapclient_scheduling_report = {}
+
+        # snapclient output is only read when underruns need to be counted
+        self.adaptive_buffer = adaptive_buffer
+        self.buffer_controller = None
+        if self.adaptive_buffer:
+            self.buffer_controller = SnapcastBufferController(None, *buffer_bounds,
+                                                              on_change=self.on_buffer_time_changed)
+
+        self.server_streaming_port = server_streaming_port
         # Start snapclient before the rpc service, to ensure snapclient can register with the server first
         self.snapclient = None
         self.start_snapclient_process()
-        # Give the client some time to register
-        time.sleep(2)
+        self.wait_for_snapclient_registration()
 
-        self.server_control_port = 1780  # This port cannot be determined through zeroconf
-        self.rpc_wrapper = SnapcastRpcWrapper(
-            server_address,
-            self.server_control_port
-        )
-        self.websocket_wrapper = SnapcastRpcWebsocketWrapper(
-            server_address,
-            self.server_control_port,
-            self.rpc_wrapper.client_id,
-            self
-        )
+        self.server_control_port = server_control_port
+        self.rpc_wrapper = self.create_rpc_wrapper()
+        self.trace_recorder.record(TRACE_INIT, {"server": server_address,
+                                                "client_id": self.rpc_wrapper.client_id,
+                                                "sync_volume": sync_volume})
+        self.websocket_wrapper = self.create_websocket_wrapper()
+        self.refresh_server_state()
+
+        if self.buffer_controller is not None:
+            self.buffer_controller.rpc_wrapper = self.rpc_wrapper
 
         self.alsa_mixer = alsa_mixer
         self.sync_volume = sync_volume
         if self.sync_volume:
-            # Import alsa only when needed, to ensure this code can still run on other platforms
-            import alsaaudio as alsa
-            self.alsa = alsa
+            self.alsa = self.load_alsa()
+            # One mixer is kept open for the lifetime of the wrapper
+            self.mixer = None
+            self.mixer_lock = threading.Lock()
             self.current_volume = self.get_system_volume()
             self.alsa_poll_thread = threading.Thread(target=self.poll_system_volume_loop)
             self.alsa_poll_thread.name = "SnapcastWrapper ALSA Volume poll thread"
 
         self.manual_pause = False
+        # The snapclient process whose exit has already been reported
+        self.dead_snapclient = None
+
+    @property
+    def playback_status(self):
+        return self.playback.state
+
+    # noinspection PyMethodMayBeStatic
+    def load_alsa(self):
+        # Import alsa only when needed, to ensure this code can still run on other platforms
+        import alsaaudio as alsa
+        return alsa
+
+    def create_dbus_service(self, glib_loop):
+        return SnapcastMPRISInterface(self, glib_loop)
+
+    # noinspection PyMethodMayBeStatic
+    def wait_for_snapclient_registration(self, delay=2):
+        # Give the client some time to register
+        time.sleep(delay)
+
+    def create_rpc_wrapper(self):
+        return SnapcastRpcWrapper(
+            self.server_address,
+            self.server_control_port,
+            self.flight_recorder
+        )
+
+    def create_websocket_wrapper(self):
+        return SnapcastRpcWebsocketWrapper(
+            self.server_address,
+            self.server_control_port,
+            self.rpc_wrapper.client_id,
+            self,
+            self.trace_recorder,
+            self.flight_recorder
+        )
 
     def run(self):
         try:
             if self.sync_volume:
-                logging.info("ALSA <-> Snapcast volume synchronisation is enabled")
+                logger.info("ALSA <-> Snapcast volume synchronisation is enabled")
                 self.alsa_poll_thread.start()
             else:
-                logging.info("ALSA <-> Snapcast volume synchronisation is disabled")
+                logger.info("ALSA <-> Snapcast volume synchronisation is disabled")
+            if self.buffer_controller is not None:
+                self.buffer_controller.start()
+            self.command_thread.start()
             self.mainloop()
         except Exception as e:
-            logging.error("SnapcastWrapper thread exception: %s", e)
+            logger.error("SnapcastWrapper thread exception: %s", e)
             sys.exit(1)
 
         if self.keep_running:
-            logging.error("SnapcastWrapper thread died - this should not happen")
+            logger.error("SnapcastWrapper thread died - this should not happen")
             sys.exit(1)
         else:
-            logging.info("SnapcastWrapper thread has exited")
+            logger.info("SnapcastWrapper thread has exited")
 
     def stop(self):
         self.websocket_wrapper.stop()
         self.keep_running = False
+        if self.command_thread.is_alive():
+            self.commands.put(None)
+            self.command_thread.join()
         if self.sync_volume:
             self.alsa_poll_thread.join()
-
-    def start_playback(self):
-        self.playback_status = PLAYBACK_PLAYING
+            with self.mixer_lock:
+                if self.mixer is not None:
+                    self.mixer.close()
+                    self.mixer = None
+        if self.buffer_controller is not None:
+            self.buffer_controller.stop()
+            self.buffer_controller.join()
+
+    def submit_command(self, kind, name, action, *args):
+        """
+        Queue a command for the command worker and return immediately
+        """
+        self.commands.put((kind, name, action, args, time.monotonic()))
+
+    def command_loop(self):
+        logger.info("SnapcastWrapper command worker started")
+        while True:
+            command = self.commands.get()
+            if command is None:
+                break
+            self.execute_command(*command)
+        logger.info("SnapcastWrapper command worker exited")
+
+    def execute_command(self, kind, name, action, args, queued_at):
+        started = time.monotonic()
+        with self.flight_recorder.span(kind, name):
+            try:
+                action(*args)
+            except Exception as e:
+                logger.exception("Command %s failed: %s", name, e)
+        finished = time.monotonic()
+        self.playback.complete(finished - queued_at)
+        logger.debug("Command %s waited %.1f ms and took %.1f ms", name,
+                     (started - queued_at) * 1000, (finished - started) * 1000)
+
+    def start_playback(self, event=EVENT_PLAY):
+        if self.playback.transition(event) is None:
+            return
         self.pause_other_players()
         if self.snapclient is None:
             self.start_snapclient_process()
         else:
-            logging.info("snapcast process is already running")
+            logger.info("snapcast process is already running")
         self.update_dbus()
         # Give snapclient a bit of time to register with the server
-        time.sleep(0.5)
-        self.rpc_wrapper.unmute()
+        self.wait_for_snapclient_registration(0.5)
+        self.set_group_muted(False)
+
+    def toggle_playback(self):
+        if self.playback_status == PLAYBACK_PLAYING:
+            self.pause_playback()
+        else:
+            self.start_playback()
 
     def autostart_on_stream(self):
-        self.playback_status = PLAYBACK_PAUSED
+        if self.playback.transition(EVENT_AUTOSTART) is None:
+            return
         if self.snapclient is None:
             self.start_snapclient_process()
         else:
-            logging.info("snapcast process is already running")
+            logger.info("snapcast process is already running")
         self.update_dbus()
 
     def pause_other_players(self):
-        logging.info("pausing other players")
-        subprocess.run(["/opt/hifiberry/bin/pause-all", "snapcast"])
+        logger.info("pausing other players")
+        with self.flight_recorder.stage("pause_other_players"):
+            if self.native_pause:
+                try:
+                    self.dbus_service.pause_other_players()
+                    return
+                except Exception as e:
+                    logger.warning("Could not pause other players through D-Bus: %s", e)
+            if self.pause_command:
+                subprocess.run([self.pause_command, "snapcast"])
 
     def start_snapclient_process(self):
-        logging.info("starting Snapclient")
-        cmd = ["/bin/snapclient", "-e"]
+        logger.info("starting Snapclient")
+        cmd = list(self.snapclient_command)
         if self.server_address is not None:
             cmd += ["-h", self.server_address]
         if self.server_streaming_port is not None:
             cmd += ["-p", str(self.server_streaming_port)]
+        buffer_time = None
+        if self.buffer_controller is not None:
+            buffer_time = self.buffer_controller.snapclient_started()
+            cmd += ["--player", "alsa:buffer_time={}".format(buffer_time)]
 
+        output = subprocess.PIPE if self.adaptive_buffer else subprocess.DEVNULL
+        # Started without a shell, so the pid is the one of snapclient itself
         self.snapclient = \
-            subprocess.Popen(" ".join(cmd),
-                             stdout=subprocess.DEVNULL,
-                             stderr=subprocess.DEVNULL,
-                             shell=True)
-        logging.info("snapclient now running in background")
-
-    def pause_playback(self):
-        self.playback_status = PLAYBACK_PAUSED
+            subprocess.Popen(cmd,
+                             stdout=output,
+                             stderr=subprocess.STDOUT if self.adaptive_buffer else subprocess.DEVNULL)
+        self.trace_recorder.record(TRACE_SNAPCLIENT, "start")
+        if self.snapclient_scheduling is not None and self.snapclient_scheduling.requested:
+            self.snapclient_scheduling_report = self.snapclient_scheduling.apply(self.snapclient.pid)
+        if self.adaptive_buffer:
+            output_thread = threading.Thread(target=self.read_snapclient_output, args=(self.snapclient, buffer_time))
+            output_thread.name = "SnapcastWrapper snapclient output reader"
+            output_thread.daemon = True
+            output_thread.start()
+        logger.info("snapclient now running in background")
+
+    def read_snapclient_output(self, snapclient, buffer_time):
+        # Ends when the process exits and closes its output
+        for line in snapclient.stdout:
+            line = line.decode("utf-8", "replace").lower()
+            if any(marker in line for marker in SNAPCLIENT_UNDERRUN_MARKERS):
+                logger.debug("snapclient underrun: %s", line.strip())
+                if self.buffer_controller is not None:
+                    self.buffer_controller.count_underrun(buffer_time)
+        snapclient.stdout.close()
+
+    def pause_playback(self, event=EVENT_PAUSE):
+        if self.playback.transition(event) is None:
+            return
         # This prevents snapcast from switching to play again after a second
         # Snapcast will only auto-play after the snapcast source has been paused on the server
         self.manual_pause = True
-        self.rpc_wrapper.mute()
+        self.set_group_muted(True)
+        self.apply_buffer_time()
         self.update_dbus()
 
+    def on_buffer_time_changed(self, buffer_time):
+        self.submit_command("buffer", "apply", self.apply_buffer_time)
+
+    def apply_buffer_time(self):
+        """
+        Restart a paused snapclient that doesn't use the current ALSA buffer
+        time yet. While playing this would cause a dropout, a stopped
+        snapclient gets it on its next start.
+        """
+        if self.buffer_controller is None or self.snapclient is None \
+                or self.playback.state != PLAYBACK_PAUSED or not self.buffer_controller.is_pending():
+            return
+        logger.info("Restarting snapclient with an ALSA buffer of %d ms", self.buffer_controller.get_buffer_time())
+        self.kill_snapclient()
+        self.start_snapclient_process()
+
     def stop_playback(self):
-        self.playback_status = PLAYBACK_STOPPED
+        if self.playback.transition(EVENT_STOP) is None:
+            return
+        # The other snapclients of the group keep running, they are muted instead
+        self.set_group_muted(True, others_only=True)
         # Not playing: kill client
         if self.snapclient is None:
-            logging.info("No snapclient running, doing nothing")
+            logger.info("No snapclient running, doing nothing")
         else:
-            logging.info("Killing snapclient, doing nothing")
-            self.snapclient.kill()
-            # Wait until it died
-            time.sleep(0.25)
-            self.snapclient = None
+            logger.info("Killing snapclient, doing nothing")
+            self.kill_snapclient()
         self.update_dbus()
 
+    def kill_snapclient(self):
+        self.snapclient.kill()
+        self.trace_recorder.record(TRACE_SNAPCLIENT, "kill")
+        # Wait until it died
+        try:
+            self.snapclient.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            logger.warning("snapclient did not exit after being killed")
+        self.snapclient = None
+
+    def next_track(self):
+        if self.can_control_stream("canGoNext"):
+            self.control_stream("next", None, 0)
+
+    def previous_track(self):
+        if self.can_control_stream("canGoPrevious"):
+            self.control_stream("previous", None, 0)
+
+    def seek(self, offset):
+        if not self.can_control_stream("canSeek"):
+            return
+        position = max(0, self.position_tracker.get_position() + offset)
+        self.control_stream("seek", {"offset": offset / 1000000}, position)
+
+    def set_position(self, position):
+        if not self.can_control_stream("canSeek") or position < 0:
+            return
+        self.control_stream("setPosition", {"position": position / 1000000}, position)
+
+    def control_stream(self, command, params, position):
+        """
+        Send a Stream.Control command and optimistically apply its result
+        to the position, so D-Bus clients don't have to wait for snapserver.
+        The next Stream.OnProperties notification confirms or corrects it.
+        """
+        previous_position = self.position_tracker.get_position()
+        if command in ("next", "previous"):
+            # Track changes are announced through the metadata, not Seeked
+            self.position_tracker.reset()
+            self.position_tracker.update(position)
+        else:
+            self.position_tracker.update(position)
+            self.dbus_service.Seeked(position)
+        self.pending_control = (command, time.monotonic())
+        try:
+            self.rpc_wrapper.control_stream(self.get_control_stream_id(), command, params)
+        except Exception as e:
+            logger.error("Stream.Control %s failed: %s", command, e)
+            self.pending_control = None
+            self.position_tracker.update(previous_position)
+            self.dbus_service.Seeked(previous_position)
+
     def update_dbus(self):
         """
         Update dbus after a change
@@ -157,48 +430,221 @@ class SnapcastWrapper(threading.Thread, SnapcastRpcListener):
         self.dbus_service.update_property('org.mpris.MediaPlayer2.Player',
                                           'PlaybackStatus')
 
-    def on_snapclient_died(self):
+    def on_snapclient_died(self, snapclient=None):
         """
         Called when the snapclient process has died
+
+        :param snapclient: the process that died, None for the current one
         """
-        logging.warning("snapclient died")
-        self.playback_status = PLAYBACK_STOPPED
+        if snapclient is not None and snapclient is not self.snapclient:
+            # Already stopped or replaced while the command was queued
+            return
+        logger.warning("snapclient died")
+        self.trace_recorder.record(TRACE_SNAPCLIENT, "died")
         self.snapclient = None
+        if self.playback.transition(EVENT_SNAPCLIENT_DIED) is not None:
+            self.update_dbus()
 
     def mainloop(self):
         while self.keep_running:
             # Check if snapcast is still running
-            if self.snapclient:
-                if self.snapclient.poll() is not None:
-                    self.on_snapclient_died()
+            snapclient = self.snapclient
+            if snapclient is not None and snapclient is not self.dead_snapclient and snapclient.poll() is not None:
+                self.dead_snapclient = snapclient
+                self.submit_command("snapclient", "died", self.on_snapclient_died, snapclient)
             time.sleep(0.2)
 
-    def on_snapserver_stream_pause(self):
-        self.pause_playback()
+    def refresh_server_state(self):
+        self.server_state_loaded_at = time.monotonic()
+        try:
+            server = self.rpc_wrapper.get_server_status()
+        except Exception as e:
+            logger.warning("Could not load the snapserver state: %s", e)
+            return
+        if server is not None:
+            self.publish_server_state_changes(self.server_state.load(server))
+
+    def on_snapserver_notification(self, method, params):
+        changes = self.server_state.apply_notification(method, params)
+        self.publish_server_state_changes(changes)
+        if self.server_state.stale and \
+                time.monotonic() - self.server_state_loaded_at >= SERVER_STATE_RELOAD_INTERVAL:
+            logger.info("Snapserver state is out of date, reloading")
+            self.refresh_server_state()
+
+    def on_snapserver_reconnect(self):
+        self.refresh_server_state()
+
+    def publish_server_state_changes(self, changes):
+        if changes:
+            self.dbus_service.StateChanged(json.dumps(changes))
+            self.notify_status_observers()
+
+    def set_client_volumes(self, volumes):
+        self.rpc_wrapper.set_client_volumes(volumes)
+
+    def get_group_volumes(self):
+        """
+        Volume of every client in our group, when group control is enabled
+
+        :return: {client id: volume}, empty if group control is disabled or the group is unknown
+        """
+        if not self.group_control:
+            return {}
+        if self.server_state.stale:
+            self.refresh_server_state()
+        return self.server_state.get_group_volumes(self.rpc_wrapper.client_id)
+
+    def set_group_muted(self, is_muted, others_only=False):
+        """
+        Mute or unmute our client, or with group control all clients of our
+        group in one batch request
+        """
+        client_ids = set(self.get_group_volumes())
+        if len(client_ids) > 1:
+            if others_only:
+                client_ids.discard(self.rpc_wrapper.client_id)
+            self.rpc_wrapper.set_client_mutes({client_id: is_muted for client_id in client_ids})
+        elif others_only:
+            return
+        elif is_muted:
+            self.rpc_wrapper.mute()
+        else:
+            self.rpc_wrapper.unmute()
+
+    def set_client_mutes(self, mutes):
+        self.rpc_wrapper.set_client_mutes(mutes)
+
+    def get_group_stream_id(self):
+        """
+        :return: the stream played by the group of our client, None if the group is unknown
+        """
+        group = self.server_state.get_group_of_client(self.rpc_wrapper.client_id)
+        return group.stream_id if group is not None else None
+
+    def get_control_stream_id(self):
+        """
+        The stream Stream.Control commands go to and whose properties are
+        followed: the one of our group, or the last one started while the
+        group is unknown
+        """
+        return self.get_group_stream_id() or self.stream_id
+
+    def is_other_group_stream(self, stream_id):
+        group_stream_id = self.get_group_stream_id()
+        return group_stream_id is not None and stream_id is not None and stream_id != group_stream_id
+
+    def on_snapserver_stream_pause(self, stream_id=None):
+        self.submit_command("ws", "stream_pause", self.handle_stream_pause, stream_id)
+
+    def handle_stream_pause(self, stream_id=None):
+        if self.is_other_group_stream(stream_id):
+            logger.debug("Ignoring pause of stream %s, it is played by another group", stream_id)
+            return
+        self.pause_playback(EVENT_STREAM_PAUSE)
         self.manual_pause = False
-        pass
 
-    def on_snapserver_stream_start(self, stream_name, stream_group):
+    def on_snapserver_stream_start(self, stream_name, stream_group, stream_id=None):
+        self.submit_command("ws", "stream_start", self.handle_stream_start, stream_name, stream_group, stream_id)
+
+    def handle_stream_start(self, stream_name, stream_group, stream_id):
+        if self.is_other_group_stream(stream_id):
+            logger.debug("Ignoring start of stream %s, it is played by another group", stream_id)
+            return
+        if stream_id != self.stream_id:
+            self.position_tracker.reset()
+            self.stream_track_id = None
+            # Capabilities of the previous stream don't apply to the new one
+            self.update_stream_capabilities({key: False for key in STREAM_CAPABILITIES})
         self.stream_name = stream_name
         self.stream_group = stream_group
+        self.stream_id = stream_id
         self.update_metadata()
         if self.manual_pause:
             # This prevents snapcast from switching to play again after a second
             # Snapcast will only auto-play after the snapcast source has been paused on the server
             return
-        self.start_playback()
+        self.start_playback(EVENT_STREAM_START)
+
+    def on_snapserver_stream_properties(self, stream_id, properties):
+        # Queued behind the stream start of the same Stream.OnUpdate, which
+        # would otherwise reset the position and capabilities afterwards
+        self.submit_command("ws", "stream_properties", self.handle_stream_properties, stream_id, properties,
+                            time.monotonic())
+
+    def handle_stream_properties(self, stream_id, properties, received_at):
+        control_stream_id = self.get_control_stream_id()
+        if control_stream_id is not None and stream_id != control_stream_id:
+            # Properties of a stream that isn't played here
+            return
+        self.update_stream_capabilities(properties)
+        self.confirm_stream_control()
+        # A missing playback status leaves the tracker as it is
+        playing = None
+        if "playbackStatus" in properties:
+            playing = properties["playbackStatus"] == "playing"
+        if "position" not in properties:
+            if playing is not None:
+                self.position_tracker.set_playing(playing)
+            return
+        # snapserver reports the position in seconds, MPRIS uses microseconds
+        position = int(properties["position"] * 1000000)
+        track = properties.get("metadata", {}).get("trackId")
+        track_changed = track != self.stream_track_id
+        self.stream_track_id = track
+        if track_changed:
+            # Publishes the new mpris:trackid
+            self.update_metadata()
+        seeked = self.position_tracker.update(position,
+                                              rate=properties.get("rate", 1.0),
+                                              playing=playing,
+                                              reported_at=received_at)
+        # A new track starts at its own position, that is not a seek.
+        # After an optimistic seek this only triggers if the server ended up
+        # somewhere else than expected.
+        if seeked and not track_changed:
+            logger.debug("Stream position jumped to %d us", position)
+            self.dbus_service.Seeked(position)
+
+    def update_stream_capabilities(self, properties):
+        for key, dbus_property in STREAM_CAPABILITIES.items():
+            if key not in properties or properties[key] == self.stream_properties.get(key):
+                continue
+            self.stream_properties[key] = properties[key]
+            self.dbus_service.update_property('org.mpris.MediaPlayer2.Player', dbus_property)
+            self.notify_status_observers()
+
+    def can_control_stream(self, capability):
+        return self.get_control_stream_id() is not None and bool(self.stream_properties.get(capability, False))
+
+    def confirm_stream_control(self):
+        if self.pending_control is None:
+            return
+        command, sent_at = self.pending_control
+        self.pending_control = None
+        logger.info("Stream.Control %s confirmed by snapserver after %.1f ms",
+                     command, (time.monotonic() - sent_at) * 1000)
 
     def on_snapserver_volume_change(self, volume_level):
         if self.sync_volume and volume_level > 0:
             self.set_system_volume(volume_level)
 
     def on_system_volume_change(self, volume_level):
-        if self.sync_volume:
+        if not self.sync_volume:
+            return
+        volumes = self.get_group_volumes()
+        if len(volumes) > 1 and self.rpc_wrapper.client_id in volumes:
+            self.rpc_wrapper.set_client_volumes(
+                scale_group_volumes(volumes, self.rpc_wrapper.client_id, max(min(volume_level, 100), 0)))
+        else:
             self.rpc_wrapper.set_volume(volume_level)
 
     def on_snapserver_mute(self):
-        self.playback_status = PLAYBACK_PAUSED
-        pass
+        self.submit_command("ws", "mute", self.handle_server_mute)
+
+    def handle_server_mute(self):
+        if self.playback.transition(EVENT_SERVER_MUTE) is not None:
+            self.update_dbus()
 
     def on_snapserver_unmute(self):
         if self.playback_status != PLAYBACK_PLAYING:
@@ -209,9 +655,9 @@ class SnapcastWrapper(threading.Thread, SnapcastRpcListener):
             pass
 
     def poll_system_volume_loop(self):
-        logging.info("SnapcastWrapper ALSA volume poll thread started")
-        mixer = self.alsa.Mixer(self.alsa_mixer)
-        descriptors = mixer.polldescriptors()
+        logger.info("SnapcastWrapper ALSA volume poll thread started")
+        with self.mixer_lock:
+            descriptors = self.get_mixer().polldescriptors()
         fd = descriptors[0][0]
         event_mask = descriptors[0][1]
         poll = select.poll()
@@ -223,42 +669,72 @@ class SnapcastWrapper(threading.Thread, SnapcastRpcListener):
             if poll_events:
                 volume = self.get_system_volume()
                 if volume != self.current_volume:
-                    logging.info("ALSA Volume changed - updating Snapserver")
-                    self.on_system_volume_change(volume)
+                    self.trace_recorder.record(TRACE_ALSA, volume)
+                    logger.info("ALSA Volume changed - updating Snapserver")
+                    with self.flight_recorder.span("alsa", "volume"):
+                        self.on_system_volume_change(volume)
                     self.current_volume = volume
         poll.unregister(fd)
-        logging.info("SnapcastWrapper ALSA volume poll thread exited")
+        logger.info("SnapcastWrapper ALSA volume poll thread exited")
 
     def set_system_volume(self, volume_level):
         if volume_level == self.get_system_volume():
             return
-        # Import alsa locally to be system-independent
-
-        mixer = self.alsa.Mixer(self.alsa_mixer)
-        mixer.setvolume(volume_level, self.alsa.MIXER_CHANNEL_ALL, self.alsa.PCM_PLAYBACK)
+        with self.mixer_lock:
+            self.get_mixer().setvolume(volume_level, self.alsa.MIXER_CHANNEL_ALL, self.alsa.PCM_PLAYBACK)
         self.current_volume = volume_level
 
     def get_system_volume(self):
-        mixer = self.alsa.Mixer(self.alsa_mixer)
-        return mixer.getvolume(self.alsa.PCM_PLAYBACK)[0]
+        with self.mixer_lock:
+            mixer = self.get_mixer()
+            if hasattr(mixer, "handleevents"):
+                # Takes in the changes made by others since the last read
+                mixer.handleevents()
+                return mixer.getvolume(self.alsa.PCM_PLAYBACK)[0]
+            # pyalsaaudio < 0.9 can't refresh a mixer, only a new one sees changes
+            fresh_mixer = self.alsa.Mixer(self.alsa_mixer)
+            try:
+                return fresh_mixer.getvolume(self.alsa.PCM_PLAYBACK)[0]
+            finally:
+                fresh_mixer.close()
+
+    def get_mixer(self):
+        if self.mixer is None:
+            self.mixer = self.alsa.Mixer(self.alsa_mixer)
+        return self.mixer
 
     def update_metadata(self):
         if self.snapclient is not None:
             self.metadata["xesam:url"] = \
-                "snapcast://{}/{}".format(self.server_address, self.stream_name)
+                "snapcast://{}/{}".format(format_host(self.server_address), self.stream_name)
             self.metadata["xesam:title"] = self.stream_name
 
         self.dbus_service.update_property('org.mpris.MediaPlayer2.Player',
                                           'Metadata')
+        self.notify_status_observers()
 
-    def get_zeroconf_server_stream_port(self):
-        zerocfg = Zeroconf()
-        service_info = zerocfg.get_service_info("_snapcast._tcp.local.",
-                                                "Snapcast._snapcast._tcp.local.",
-                                                3000)
-        logging.debug(service_info)
-        if service_info is None or service_info.parsed_addresses(IPVersion.All)[0] != self.server_address:
-            logging.warning("Failed to obtain snapserver streaming port through zeroconf!")
-            return 1704
-        logging.info("Obtained snapserver streaming port through zeroconf: " + str(service_info.port))
-        return service_info.port
+    def notify_status_observers(self):
+        for observer in self.status_observers:
+            observer()
+
+    def get_status_snapshot(self):
+        """
+        Playback state, metadata, volume and stream information as a JSON-compatible dict
+        """
+        client = self.server_state.get_client(self.rpc_wrapper.client_id)
+        stream = self.server_state.get_stream(self.stream_id)
+        return {
+            "playback_status": self.playback_status,
+            "metadata": dict(self.metadata),
+            "volume": client.get("volume"),
+            "muted": client.get("muted"),
+            "stream": {
+                "id": self.stream_id,
+                "name": self.stream_name,
+                "status": stream.get("status"),
+                "can_go_next": self.can_control_stream("canGoNext"),
+                "can_go_previous": self.can_control_stream("canGoPrevious"),
+                "can_seek": self.can_control_stream("canSeek"),
+            },
+            "snapclient_scheduling": self.snapclient_scheduling_report,
+        }
@@ -9,8 +9,13 @@ import signal
 import configparser
 import argparse
 
-from snapcastmpris.SnapcastWrapper import SnapcastWrapper
-from zeroconf import Zeroconf, IPVersion
+from snapcastmpris.SnapcastWrapper import SnapcastWrapper, PAUSE_ALL_COMMAND
+from snapcastmpris.SnapcastTraceRecorder import SnapcastTraceRecorder
+from snapcastmpris.SnapcastFlightRecorder import SnapcastFlightRecorder
+from snapcastmpris.SnapcastLogging import configure_log_levels
+from snapcastmpris.SnapcastServerDiscovery import discover_server
+from snapcastmpris.SnapcastStatusServer import SnapcastStatusServer
+from snapcastmpris.SnapcastProcessScheduling import SnapcastProcessScheduling
 
 import dbus.service
 from dbus.mainloop.glib import DBusGMainLoop
@@ -21,15 +26,27 @@ try:
 except ImportError:
     import glib as GLib
 
+logger = logging.getLogger(__name__)
+
+# Check every second whether the GLib main loop was blocked longer than
+# MAIN_LOOP_STALL_WARNING milliseconds, e.g. by a D-Bus method
+MAIN_LOOP_CHECK_INTERVAL = 1000
+MAIN_LOOP_STALL_WARNING = 100
+
+# Used by the signal handlers
+snapcast_wrapper = None
+
 
 def stop_snapcast(signalNumber, frame):
-    logging.info("received USR1, stopping snapcast")
-    snapcast_wrapper.stop_playback()
+    logger.info("received USR1, stopping snapcast")
+    if snapcast_wrapper is not None:
+        snapcast_wrapper.submit_command("signal", "SIGUSR1", snapcast_wrapper.stop_playback)
 
 
 def pause_snapcast(signalNumber, frame):
-    logging.info("received USR2, pausing snapcast")
-    snapcast_wrapper.pause_playback()
+    logger.info("received USR2, pausing snapcast")
+    if snapcast_wrapper is not None:
+        snapcast_wrapper.submit_command("signal", "SIGUSR2", snapcast_wrapper.pause_playback)
 
 
 def read_config():
@@ -37,39 +54,29 @@ def read_config():
     try:
         with open("/etc/snapcastmpris.conf") as f:
             config.read_string("[snapcast]\n" + f.read())
-        logging.info("read /etc/snapcastmpris.conf")
+        logger.info("read /etc/snapcastmpris.conf")
     except Exception:
-        logging.info("can't read /etc/snapcastmpris.conf, using default configurations")
+        logger.info("can't read /etc/snapcastmpris.conf, using default configurations")
 
     return config
 
 
-def get_zeroconf_server_address():
-    zerocfg = Zeroconf()
-    service_info = zerocfg.get_service_info("_snapcast._tcp.local.", "Snapcast._snapcast._tcp.local.", 3000)
-    if service_info is None:
-        logging.error("Failed to obtain snapserver address through zeroconf!")
-        return None
-    logging.debug(service_info)
-    snapserver_address = None
-    all_addresses = service_info.parsed_addresses(IPVersion.V4Only)
-    for address in all_addresses:
-        if address != "0.0.0.0":
-            snapserver_address = address
-    if snapserver_address is None:
-        logging.critical("Failed to obtain snapserver address through zeroconf, got 0.0.0.0 but expected real address!")
-        logging.error(service_info)
-        logging.error(all_addresses)
-        return None
-    if len(all_addresses) > 1:
-        logging.warning("Got more than one zeroconf address, what's happening here?!")
-        logging.warning(service_info)
-        logging.warning(all_addresses)
-    logging.info("Obtained snapserver address through zeroconf: " + snapserver_address)
-    return snapserver_address
+def watch_main_loop():
+    expected = [time.monotonic() + MAIN_LOOP_CHECK_INTERVAL / 1000]
+
+    def check_main_loop():
+        now = time.monotonic()
+        stall = (now - expected[0]) * 1000
+        if stall > MAIN_LOOP_STALL_WARNING:
+            logger.warning("GLib main loop was blocked for %d ms", stall)
+        expected[0] = now + MAIN_LOOP_CHECK_INTERVAL / 1000
+        return True
+
+    GLib.timeout_add(MAIN_LOOP_CHECK_INTERVAL, check_main_loop)
 
 
 def main():
+    global snapcast_wrapper
     DBusGMainLoop(set_as_default=True)
 
     # Parse arguments
@@ -80,6 +87,8 @@ def main():
     parser.add_argument('-v', '--verbose', action='store_true', help='enable verbose logging')
     parser.add_argument('-s', '--sync_alsa_volume', action='store_true', help='enable synchronization with alsa volume')
     parser.add_argument('-m', '--mixer', default='Softvol', type=str, help='set custom mixer for alsa')
+    parser.add_argument('-t', '--trace', default=None, type=str,
+                        help='record incoming events to this file, for replay with snapcastmpris-replay')
 
     args = parser.parse_args()
 
@@ -94,14 +103,15 @@ def main():
 
     # Set up the main loop
     glib_main_loop = GLib.MainLoop()
-    signal.signal(signal.SIGUSR1, pause_snapcast)
-    signal.signal(signal.SIGUSR2, stop_snapcast)
+    signal.signal(signal.SIGUSR1, stop_snapcast)
+    signal.signal(signal.SIGUSR2, pause_snapcast)
 
     try:
         config = read_config()
-        server_address = config.get("snapcast", "server", fallback=get_zeroconf_server_address())
+        configure_log_levels(config)
+        server_address, server_streaming_port = discover_server(config.get("snapcast", "server", fallback=None))
         if not server_address:
-            logging.critical("Snapcast cannot be launched: failed to obtain snapcast server address.")
+            logger.critical("Snapcast cannot be launched: failed to obtain snapcast server address.")
             exit(1)
 
         if config.has_option("snapcast", "alsa-mixer"):
@@ -110,31 +120,62 @@ def main():
         if not volume_sync_enabled and config.has_option("snapcast", "sync-alsa-volume"):
             volume_sync_enabled = config.getboolean("snapcast", "sync-alsa-volume", fallback=False)
 
-        snapcast_wrapper = SnapcastWrapper(glib_main_loop, server_address, sync_volume=volume_sync_enabled, alsa_mixer=mixer)
+        trace_file = args.trace or config.get("snapcast", "trace-file", fallback=None)
+        trace_recorder = SnapcastTraceRecorder(trace_file)
+        flight_recorder = SnapcastFlightRecorder(config.getint("snapcast", "flight-recorder-size", fallback=256))
+
+        adaptive_buffer = config.getboolean("snapcast", "adaptive-buffer", fallback=False)
+        buffer_bounds = (config.getint("snapcast", "alsa-buffer-min", fallback=80),
+                         config.getint("snapcast", "alsa-buffer-max", fallback=400))
+
+        snapcast_wrapper = SnapcastWrapper(glib_main_loop, server_address, server_streaming_port,
+                                           sync_volume=volume_sync_enabled, alsa_mixer=mixer,
+                                           trace_recorder=trace_recorder, flight_recorder=flight_recorder,
+                                           adaptive_buffer=adaptive_buffer, buffer_bounds=buffer_bounds,
+                                           native_pause=config.getboolean("snapcast", "native-pause", fallback=True),
+                                           pause_command=config.get("snapcast", "pause-command",
+                                                                    fallback=PAUSE_ALL_COMMAND),
+                                           snapclient_scheduling=SnapcastProcessScheduling.from_config(config),
+                                           group_control=config.getboolean("snapcast", "group-control",
+                                                                           fallback=False))
+
+        status_server = None
+        status_port = config.getint("snapcast", "status-port", fallback=None)
+        status_socket = config.get("snapcast", "status-socket", fallback=None)
+        if status_port is not None or status_socket is not None:
+            status_server = SnapcastStatusServer(snapcast_wrapper.get_status_snapshot,
+                                                 port=status_port, socket_path=status_socket)
+            snapcast_wrapper.status_observers.append(status_server.notify_changed)
+            status_server.start()
 
         if config.getboolean("snapcast", "autostart", fallback=True):
-            snapcast_wrapper.autostart_on_stream()
+            snapcast_wrapper.submit_command("main", "autostart", snapcast_wrapper.autostart_on_stream)
 
         snapcast_wrapper.start()
-        logging.info("Snapcast wrapper thread started")
+        logger.info("Snapcast wrapper thread started")
 
     except dbus.exceptions.DBusException as e:
-        logging.error("DBUS error: %s", e)
+        logger.error("DBUS error: %s", e)
         sys.exit(1)
 
     time.sleep(2)
     if not snapcast_wrapper.is_alive():
-        logging.error("Snapcast connector thread died, exiting")
+        logger.error("Snapcast connector thread died, exiting")
         sys.exit(1)
 
     try:
-        logging.info("main loop started")
+        logger.info("main loop started")
+        watch_main_loop()
         glib_main_loop.run()
     except KeyboardInterrupt:
-        logging.debug('Caught SIGINT, exiting.')
+        logger.debug('Caught SIGINT, exiting.')
+    if status_server is not None:
+        status_server.stop()
+        status_server.join()
     snapcast_wrapper.stop()
     snapcast_wrapper.join()
-    logging.info("All threads have exited")
+    trace_recorder.close()
+    logger.info("All threads have exited")
 
 
 if __name__ == '__main__':
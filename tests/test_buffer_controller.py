@@ -0,0 +1,61 @@
+import logging
+
+from snapcastmpris.SnapcastBufferController import SnapcastBufferController
+
+
+def make_controller():
+    changes = []
+    controller = SnapcastBufferController(None, min_buffer=80, max_buffer=400, step=20, clean_intervals=3,
+                                          on_change=changes.append)
+    return controller, changes
+
+
+def test_raise_waits_for_the_restart():
+    controller, changes = make_controller()
+    buffer_time = controller.snapclient_started()
+
+    # One underrun per interval from a snapclient that is never restarted
+    for _ in range(16):
+        controller.count_underrun(buffer_time)
+        controller.adjust_buffer()
+    assert controller.get_buffer_time() == 100
+    assert changes == [100]
+    assert controller.is_pending()
+
+    buffer_time = controller.snapclient_started()
+    assert buffer_time == 100
+    assert not controller.is_pending()
+    controller.count_underrun(buffer_time)
+    controller.adjust_buffer()
+    assert controller.get_buffer_time() == 120
+    assert changes == [100, 120]
+
+
+def test_underruns_of_an_outdated_snapclient_are_ignored():
+    controller, changes = make_controller()
+    old_buffer_time = controller.snapclient_started()
+    controller.count_underrun(old_buffer_time)
+    controller.adjust_buffer()
+    new_buffer_time = controller.snapclient_started()
+
+    controller.count_underrun(old_buffer_time)
+    controller.adjust_buffer()
+    assert controller.get_buffer_time() == new_buffer_time
+
+
+def test_lower_after_clean_intervals():
+    controller, changes = make_controller()
+    controller.count_underrun(controller.snapclient_started())
+    controller.adjust_buffer()
+    controller.snapclient_started()
+    for _ in range(3):
+        controller.adjust_buffer()
+    assert changes == [100, 80]
+
+
+def test_keep_is_logged_at_debug(caplog):
+    controller, _ = make_controller()
+    controller.snapclient_started()
+    with caplog.at_level(logging.DEBUG, logger="snapcastmpris.SnapcastBufferController"):
+        controller.adjust_buffer()
+    assert [record.levelno for record in caplog.records] == [logging.DEBUG]
@@ -0,0 +1,172 @@
+import logging
+import signal
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("dbus")
+pytest.importorskip("websocket")
+
+from snapcastmpris.SnapcastMPRISInterface import SnapcastMPRISInterface  # noqa: E402
+from snapcastmpris.SnapcastWrapper import SnapcastWrapper  # noqa: E402
+from snapcastmpris.SnapcastTraceReplay import ReplaySnapcastWrapper  # noqa: E402
+
+# A D-Bus method call must not wait for the command it triggers
+RETURN_BOUND = 0.1
+# How long the actions of BlockingWrapper block
+ACTION_DURATION = 2
+
+
+class BlockingWrapper(ReplaySnapcastWrapper):
+    """
+    Wrapper with the real command worker whose playback actions block until
+    released, like a snapclient that takes long to start or stop
+    """
+
+    submit_command = SnapcastWrapper.submit_command
+
+    def __init__(self):
+        super().__init__("127.0.0.1", "00:00:00:00:00:01", sync_volume=False)
+        self.release = threading.Event()
+        self.executed = []
+
+    def block(self, name):
+        self.release.wait(ACTION_DURATION)
+        self.executed.append(name)
+
+    def start_playback(self, event=None):
+        self.block("Play")
+
+    def stop_playback(self):
+        self.block("Stop")
+
+
+@pytest.fixture
+def wrapper():
+    wrapper = BlockingWrapper()
+    wrapper.command_thread.start()
+    yield wrapper
+    wrapper.release.set()
+    wrapper.commands.put(None)
+    wrapper.command_thread.join()
+
+
+@pytest.fixture
+def interface(wrapper):
+    # Not exported on a bus, the methods are called directly
+    interface = SnapcastMPRISInterface.__new__(SnapcastMPRISInterface)
+    interface.wrapper_instance = wrapper
+    return interface
+
+
+@pytest.mark.parametrize("method", ["Play", "Stop"])
+def test_method_returns_while_the_action_blocks(interface, wrapper, method):
+    started = time.monotonic()
+    getattr(interface, method)()
+    assert time.monotonic() - started < RETURN_BOUND
+    assert wrapper.executed == []
+
+    done = threading.Event()
+    wrapper.release.set()
+    wrapper.submit_command("test", "barrier", done.set)
+    assert done.wait(ACTION_DURATION)
+    assert wrapper.executed == [method]
+
+
+def test_methods_queue_behind_a_blocking_action(interface, wrapper):
+    started = time.monotonic()
+    interface.Play()
+    interface.Stop()
+    interface.Play()
+    assert time.monotonic() - started < RETURN_BOUND * 3
+
+    done = threading.Event()
+    wrapper.release.set()
+    wrapper.submit_command("test", "barrier", done.set)
+    assert done.wait(ACTION_DURATION)
+    assert wrapper.executed == ["Play", "Stop", "Play"]
+
+
+def test_failing_command_is_logged_with_traceback(wrapper, caplog):
+    def fail():
+        raise RuntimeError("snapclient not found")
+
+    done = threading.Event()
+    with caplog.at_level(logging.ERROR, logger="snapcastmpris.SnapcastWrapper"):
+        wrapper.submit_command("test", "fail", fail)
+        wrapper.submit_command("test", "barrier", done.set)
+        assert done.wait(ACTION_DURATION)
+
+    records = [record for record in caplog.records if "fail" in record.getMessage()]
+    assert len(records) == 1
+    assert records[0].exc_info is not None
+    assert records[0].exc_info[0] is RuntimeError
+
+
+def test_metadata_has_the_track_id(interface, wrapper):
+    assert interface.get_metadata()["mpris:trackid"] == "/org/mpris/MediaPlayer2/TrackList/NoTrack"
+
+    wrapper.stream_id = "spotify"
+    wrapper.stream_track_id = "spotify:track:4uLU6hMCjMI75M1A2tKUQC"
+    track_id = interface.get_metadata()["mpris:trackid"]
+    assert track_id == "/org/hifiberry/snapcast/track/spotify/spotify_3atrack_3a4uLU6hMCjMI75M1A2tKUQC"
+
+    wrapper.stream_track_id = "other"
+    assert interface.get_metadata()["mpris:trackid"] != track_id
+
+
+def test_set_position_of_the_current_track(interface, wrapper):
+    positions = []
+    wrapper.set_position = positions.append
+    wrapper.stream_id = "default"
+    wrapper.stream_track_id = "track-1"
+
+    interface.SetPosition(interface.get_track_id(), 42000000)
+    done = threading.Event()
+    wrapper.submit_command("test", "barrier", done.set)
+    assert done.wait(ACTION_DURATION)
+    assert positions == [42000000]
+
+
+@pytest.mark.parametrize("track_id", [
+    "/org/hifiberry/snapcast/track/default/track_2d0",
+    "/org/hifiberry/snapcast/track/default",
+    "/org/mpris/MediaPlayer2/TrackList/NoTrack",
+])
+def test_set_position_of_another_track_is_ignored(interface, wrapper, track_id):
+    positions = []
+    wrapper.set_position = positions.append
+    wrapper.stream_id = "default"
+    wrapper.stream_track_id = "track-1"
+
+    interface.SetPosition(track_id, 42000000)
+    done = threading.Event()
+    wrapper.submit_command("test", "barrier", done.set)
+    assert done.wait(ACTION_DURATION)
+    assert positions == []
+
+
+
+def test_signal_handler_can_submit_while_a_command_is_submitted(wrapper):
+    # Like the SIGUSR1/SIGUSR2 handlers, which run on the main thread while
+    # it may be inside submit_command for a D-Bus call
+    signalled = []
+
+    def handler(signum, frame):
+        wrapper.submit_command("signal", "SIGALRM", signalled.append, signum)
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, 0.0001, 0.0001)
+    try:
+        started = time.monotonic()
+        while time.monotonic() - started < 0.5:
+            wrapper.submit_command("dbus", "Play", lambda: None)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+    done = threading.Event()
+    wrapper.submit_command("test", "barrier", done.set)
+    assert done.wait(ACTION_DURATION * 5)
+    assert signalled
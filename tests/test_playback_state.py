@@ -0,0 +1,50 @@
+import pytest
+
+from snapcastmpris.SnapcastPlaybackState import SnapcastPlaybackState, TRANSITIONS, IGNORED_EVENTS, \
+    PLAYBACK_STOPPED, PLAYBACK_PAUSED, PLAYBACK_PLAYING, EVENT_PLAY, EVENT_PAUSE, EVENT_AUTOSTART, \
+    EVENT_SNAPCLIENT_DIED
+
+
+def test_transition():
+    playback = SnapcastPlaybackState()
+    assert playback.transition(EVENT_PLAY) == PLAYBACK_PLAYING
+    assert playback.transition(EVENT_PAUSE) == PLAYBACK_PAUSED
+    assert playback.transition(EVENT_SNAPCLIENT_DIED) == PLAYBACK_STOPPED
+    assert playback.transition_count == 3
+
+
+@pytest.mark.parametrize("event", sorted(IGNORED_EVENTS[PLAYBACK_STOPPED]))
+def test_ignored_events_while_stopped(event):
+    playback = SnapcastPlaybackState(PLAYBACK_STOPPED)
+    assert playback.transition(event) is None
+    assert playback.state == PLAYBACK_STOPPED
+    assert not playback.impossible
+    assert playback.transition_count == 0
+
+
+def test_snapclient_crash_while_stopped_is_not_impossible():
+    playback = SnapcastPlaybackState(PLAYBACK_STOPPED)
+    playback.transition(EVENT_SNAPCLIENT_DIED)
+    assert playback.dump()["impossible"] == []
+
+
+def test_impossible_transition_is_counted():
+    playback = SnapcastPlaybackState(PLAYBACK_PLAYING)
+    assert playback.transition(EVENT_AUTOSTART) is None
+    assert playback.state == PLAYBACK_PLAYING
+    assert playback.dump()["impossible"] == [{"state": PLAYBACK_PLAYING, "event": EVENT_AUTOSTART, "count": 1}]
+
+
+def test_ignored_events_have_no_transition():
+    for state, events in IGNORED_EVENTS.items():
+        assert not events & set(TRANSITIONS[state])
+
+
+def test_complete_records_the_duration():
+    playback = SnapcastPlaybackState()
+    playback.transition(EVENT_PLAY)
+    playback.complete(0.25)
+    dump = playback.dump()
+    assert dump["transitions"] == [{"from": PLAYBACK_STOPPED, "event": EVENT_PLAY, "to": PLAYBACK_PLAYING,
+                                    "count": 1, "mean_ms": 250.0, "max_ms": 250.0}]
+    assert dump["history"][-1]["ms"] == 250.0
@@ -0,0 +1,242 @@
+import pytest
+
+from snapcastmpris.SnapcastModels import parse_status_tree
+from snapcastmpris.SnapcastPositionTracker import SnapcastPositionTracker, SEEK_TOLERANCE_US
+
+
+class FakeClock:
+
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def tracker(clock):
+    return SnapcastPositionTracker(clock=clock)
+
+
+def test_position_is_zero_initially(tracker, clock):
+    clock.advance(5)
+    assert tracker.get_position() == 0
+
+
+@pytest.mark.parametrize("rate, expected_us", [
+    (1.0, 12000000),
+    (2.0, 14000000),
+    (0.5, 11000000),
+    (0.0, 10000000),
+    (-1.0, 8000000),
+])
+def test_interpolation_follows_rate(tracker, clock, rate, expected_us):
+    tracker.update(10000000, rate=rate, playing=True)
+    clock.advance(2)
+    assert tracker.get_position() == expected_us
+
+
+def test_interpolation_does_not_go_below_zero(tracker, clock):
+    tracker.update(1000000, rate=-1.0, playing=True)
+    clock.advance(5)
+    assert tracker.get_position() == 0
+
+
+def test_interpolation_starts_at_the_report_time(tracker, clock):
+    received_at = clock()
+    clock.advance(0.5)
+    tracker.update(10000000, playing=True, reported_at=received_at)
+    assert tracker.get_position() == 10500000
+
+
+def test_rate_is_kept_until_reported_again(tracker, clock):
+    tracker.update(0, rate=2.0, playing=True)
+    clock.advance(1)
+    tracker.update(2000000, playing=True)
+    clock.advance(1)
+    assert tracker.get_position() == 4000000
+
+
+def test_position_does_not_move_while_paused(tracker, clock):
+    tracker.update(10000000, playing=False)
+    clock.advance(30)
+    assert tracker.get_position() == 10000000
+
+
+def test_freeze_and_resume(tracker, clock):
+    tracker.update(10000000, playing=True)
+    clock.advance(3)
+    tracker.set_playing(False)
+    assert tracker.get_position() == 13000000
+
+    clock.advance(60)
+    assert tracker.get_position() == 13000000
+
+    tracker.set_playing(True)
+    clock.advance(2)
+    assert tracker.get_position() == 15000000
+
+
+def test_resume_keeps_the_rate(tracker, clock):
+    tracker.update(0, rate=2.0, playing=True)
+    clock.advance(1)
+    tracker.set_playing(False)
+    clock.advance(10)
+    tracker.set_playing(True)
+    clock.advance(1)
+    assert tracker.get_position() == 4000000
+
+
+def test_first_report_is_not_a_jump(tracker, clock):
+    clock.advance(100)
+    assert not tracker.update(120000000, playing=True)
+
+
+def test_jitter_within_tolerance_is_not_a_jump(tracker, clock):
+    tracker.update(10000000, playing=True)
+    clock.advance(10)
+    assert not tracker.update(20000000 + SEEK_TOLERANCE_US, playing=True)
+    clock.advance(10)
+    assert not tracker.update(30000000, playing=True)
+
+
+def test_jump_beyond_tolerance(tracker, clock):
+    tracker.update(10000000, playing=True)
+    clock.advance(10)
+    assert tracker.update(20000000 + SEEK_TOLERANCE_US + 1, playing=True)
+
+
+def test_jump_backwards(tracker, clock):
+    tracker.update(10000000, playing=True)
+    clock.advance(10)
+    assert tracker.update(0, playing=True)
+
+
+def test_jump_while_paused(tracker, clock):
+    tracker.update(10000000, playing=False)
+    clock.advance(10)
+    assert not tracker.update(10000000, playing=False)
+    assert tracker.update(60000000, playing=False)
+
+
+def test_track_change_is_reported_as_a_jump(tracker, clock):
+    # The tracker doesn't know about tracks: a new track starting at 0 is a
+    # jump, the wrapper only sends Seeked when the track stayed the same
+    tracker.update(200000000, playing=True)
+    clock.advance(5)
+    assert tracker.update(0, playing=True)
+    assert tracker.get_position() == 0
+
+
+def test_track_change_close_to_the_expected_position_is_not_a_jump(tracker, clock):
+    tracker.update(0, playing=True)
+    clock.advance(0.5)
+    assert not tracker.update(0, playing=True)
+
+
+def test_reset_forgets_the_position(tracker, clock):
+    tracker.update(200000000, playing=True)
+    clock.advance(5)
+    tracker.reset()
+    assert tracker.get_position() == 0
+    # The first position after a reset, e.g. of a new stream, is no jump
+    assert not tracker.update(50000000, playing=True)
+    clock.advance(1)
+    assert tracker.get_position() == 51000000
+
+
+@pytest.fixture
+def wrapper(clock):
+    pytest.importorskip("dbus")
+    pytest.importorskip("websocket")
+    from snapcastmpris.SnapcastTraceReplay import ReplaySnapcastWrapper
+    wrapper = ReplaySnapcastWrapper("127.0.0.1", "00:00:00:00:00:01", sync_volume=False)
+    wrapper.position_tracker = SnapcastPositionTracker(clock=clock)
+    wrapper.stream_id = "default"
+    return wrapper
+
+
+def report_position(wrapper, clock, seconds, track):
+    wrapper.handle_stream_properties("default", {"position": seconds, "playbackStatus": "playing",
+                                                 "metadata": {"trackId": track}}, clock())
+
+
+def test_seeked_on_a_jump_within_the_track(wrapper, clock):
+    report_position(wrapper, clock, 10, "track-1")
+    clock.advance(10)
+    report_position(wrapper, clock, 20.5, "track-1")
+    assert wrapper.dbus_service.calls["Seeked"] == 0
+
+    clock.advance(10)
+    report_position(wrapper, clock, 90, "track-1")
+    assert wrapper.dbus_service.calls["Seeked"] == 1
+
+
+def test_no_seeked_on_a_track_change(wrapper, clock):
+    report_position(wrapper, clock, 200, "track-1")
+    clock.advance(5)
+    report_position(wrapper, clock, 0, "track-2")
+    assert wrapper.dbus_service.calls["Seeked"] == 0
+    assert wrapper.position_tracker.get_position() == 0
+
+    # Seeks within the new track are reported again
+    clock.advance(5)
+    report_position(wrapper, clock, 30, "track-2")
+    assert wrapper.dbus_service.calls["Seeked"] == 1
+
+
+def load_groups(wrapper, streams):
+    """
+    :param streams: {group id: stream id}, our client is in the first group
+    """
+    groups = []
+    for index, (group_id, stream_id) in enumerate(streams.items()):
+        client_id = wrapper.rpc_wrapper.client_id if index == 0 else "00:00:00:00:01:{:02x}".format(index)
+        groups.append({"id": group_id, "name": "", "stream_id": stream_id, "muted": False,
+                       "clients": [{"id": client_id, "connected": True, "host": {"name": group_id},
+                                    "config": {"name": "", "latency": 0,
+                                               "volume": {"percent": 50, "muted": False}}}]})
+    streams = [{"id": stream_id, "status": "playing", "uri": {"raw": "pipe:///tmp/" + stream_id}}
+               for stream_id in set(streams.values())]
+    wrapper.server_state.load(parse_status_tree({"groups": groups, "streams": streams}))
+
+
+def test_stream_control_goes_to_the_stream_of_our_group(wrapper, clock):
+    load_groups(wrapper, {"kitchen": "default", "living": "spotify"})
+    controlled = []
+    wrapper.rpc_wrapper.control_stream = lambda stream_id, command, params: controlled.append(stream_id)
+
+    wrapper.handle_stream_start("spotify", "", "spotify")
+    assert wrapper.stream_id == "default"
+    wrapper.handle_stream_properties("spotify", {"canGoNext": False}, clock())
+    wrapper.handle_stream_properties("default", {"canGoNext": True}, clock())
+    wrapper.next_track()
+    assert controlled == ["default"]
+
+
+def test_properties_of_other_streams_are_ignored(wrapper, clock):
+    load_groups(wrapper, {"kitchen": "default", "living": "spotify"})
+    report_position(wrapper, clock, 10, "track-1")
+    wrapper.handle_stream_properties("spotify", {"position": 200, "playbackStatus": "playing",
+                                                 "metadata": {"trackId": "other"}}, clock())
+    assert wrapper.stream_track_id == "track-1"
+    assert wrapper.position_tracker.get_position() == 10000000
+
+
+@pytest.mark.parametrize("properties, expected_us", [
+    ({"position": 10.0, "metadata": {"trackId": "track-1"}}, 15000000),
+    ({"canSeek": True}, 5000000),
+])
+def test_missing_playback_status_keeps_playing(wrapper, clock, properties, expected_us):
+    report_position(wrapper, clock, 0, "track-1")
+    wrapper.handle_stream_properties("default", properties, clock())
+    clock.advance(5)
+    assert wrapper.position_tracker.get_position() == expected_us
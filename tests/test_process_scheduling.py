@@ -0,0 +1,124 @@
+import configparser
+import errno
+import logging
+import os
+import platform
+import resource
+import subprocess
+
+import pytest
+
+from snapcastmpris.SnapcastProcessScheduling import SnapcastProcessScheduling, IOPRIO_SYSCALLS, parse_cpus, \
+    parse_ioprio
+
+# Without privileges, real-time scheduling fails with EPERM
+UNPRIVILEGED = os.geteuid() != 0 and resource.getrlimit(resource.RLIMIT_RTPRIO)[0] == 0
+
+
+@pytest.fixture
+def child():
+    process = subprocess.Popen(["sleep", "60"])
+    yield process
+    process.kill()
+    process.wait()
+
+
+def read_config(**settings):
+    config = configparser.ConfigParser()
+    config.read_dict({"snapcast": {key.replace("_", "-"): value for key, value in settings.items()}})
+    return config
+
+
+def test_apply_nice(child):
+    nice = os.getpriority(os.PRIO_PROCESS, 0) + 5
+    report = SnapcastProcessScheduling(nice=nice).apply(child.pid)
+    assert report["nice"] == {"requested": nice, "applied": nice, "error": None}
+    assert os.getpriority(os.PRIO_PROCESS, child.pid) == nice
+
+
+def test_apply_affinity(child):
+    cpu = min(os.sched_getaffinity(0))
+    report = SnapcastProcessScheduling(cpus={cpu}).apply(child.pid)
+    assert report["cpus"] == {"requested": [cpu], "applied": [cpu], "error": None}
+    assert os.sched_getaffinity(child.pid) == {cpu}
+
+
+@pytest.mark.skipif(platform.machine() not in IOPRIO_SYSCALLS, reason="no ioprio syscalls for this architecture")
+def test_apply_ioprio(child):
+    report = SnapcastProcessScheduling(ioprio=("idle", 0)).apply(child.pid)
+    assert report["ioprio"] == {"requested": ("idle", 0), "applied": ("idle", 0), "error": None}
+
+
+@pytest.mark.skipif(not UNPRIVILEGED, reason="real-time scheduling is permitted")
+def test_apply_fifo_without_privileges(child):
+    report = SnapcastProcessScheduling(policy="fifo", priority=50).apply(child.pid)
+    assert report["scheduler"]["requested"] == ("fifo", 50)
+    assert report["scheduler"]["applied"] == ("other", 0)
+    assert os.strerror(errno.EPERM) in report["scheduler"]["error"]
+
+
+def test_apply_reports_eperm(child, monkeypatch):
+    def sched_setscheduler(pid, policy, param):
+        raise PermissionError(errno.EPERM, os.strerror(errno.EPERM))
+
+    monkeypatch.setattr(os, "sched_setscheduler", sched_setscheduler)
+    report = SnapcastProcessScheduling(nice=os.getpriority(os.PRIO_PROCESS, 0), policy="fifo",
+                                       priority=50).apply(child.pid)
+    assert report["scheduler"]["applied"] == ("other", 0)
+    assert os.strerror(errno.EPERM) in report["scheduler"]["error"]
+    # The other settings are still applied
+    assert report["nice"]["error"] is None
+
+
+def test_from_config():
+    scheduling = SnapcastProcessScheduling.from_config(read_config(
+        snapclient_nice="-10", snapclient_scheduler="FIFO", snapclient_priority="50",
+        snapclient_cpus="0-1,3", snapclient_ioprio="rt:4"))
+    assert scheduling.nice == -10
+    assert scheduling.policy == "fifo"
+    assert scheduling.priority == 50
+    assert scheduling.cpus == {0, 1, 3}
+    assert scheduling.ioprio == ("rt", 4)
+
+
+def test_from_config_without_settings():
+    assert not SnapcastProcessScheduling.from_config(read_config()).requested
+
+
+@pytest.mark.parametrize("key, value, attribute", [
+    ("snapclient_nice", "high", "nice"),
+    ("snapclient_cpus", "two", "cpus"),
+    ("snapclient_cpus", "1-x", "cpus"),
+    ("snapclient_cpus", ",", "cpus"),
+    ("snapclient_ioprio", "rt:x", "ioprio"),
+    ("snapclient_ioprio", "rt:9", "ioprio"),
+    ("snapclient_ioprio", "fast:1", "ioprio"),
+    ("snapclient_scheduler", "deadline", "policy"),
+])
+def test_from_config_skips_invalid_values(caplog, key, value, attribute):
+    settings = {"snapclient_nice": "5", key: value}
+    with caplog.at_level(logging.WARNING, logger="snapcastmpris.SnapcastProcessScheduling"):
+        scheduling = SnapcastProcessScheduling.from_config(read_config(**settings))
+    assert getattr(scheduling, attribute) is None
+    assert value in caplog.text
+    if attribute != "nice":
+        # Valid settings next to an invalid one are kept
+        assert scheduling.nice == 5
+
+
+def test_from_config_invalid_priority_falls_back_to_zero(caplog):
+    scheduling = SnapcastProcessScheduling.from_config(read_config(snapclient_scheduler="rr",
+                                                                   snapclient_priority="max"))
+    assert scheduling.policy == "rr"
+    assert scheduling.priority == 0
+    assert "snapclient-priority" in caplog.text
+
+
+def test_parse_cpus():
+    assert parse_cpus("2,3") == {2, 3}
+    assert parse_cpus(" 0-2 , 5 ") == {0, 1, 2, 5}
+
+
+def test_parse_ioprio():
+    assert parse_ioprio("idle") == ("idle", 0)
+    assert parse_ioprio("be:7") == ("be", 7)
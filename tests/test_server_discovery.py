@@ -0,0 +1,58 @@
+import socket
+
+import pytest
+
+pytest.importorskip("zeroconf")
+
+from snapcastmpris import SnapcastServerDiscovery  # noqa: E402
+from snapcastmpris.SnapcastServerDiscovery import format_host, prefer_routable, discover_server  # noqa: E402
+
+
+class FakeServiceInfo:
+
+    def __init__(self, addresses, port=1704):
+        self.addresses = addresses
+        self.port = port
+
+    def parsed_scoped_addresses(self, version):
+        return self.addresses
+
+
+@pytest.mark.parametrize("address, escape_scope, host", [
+    ("192.168.1.2", True, "192.168.1.2"),
+    ("2001:db8::1", True, "[2001:db8::1]"),
+    ("fe80::1%eth0", True, "[fe80::1%25eth0]"),
+    ("fe80::1%eth0", False, "[fe80::1%eth0]"),
+])
+def test_format_host(address, escape_scope, host):
+    assert format_host(address, escape_scope) == host
+
+
+def test_websocket_url_of_a_scoped_address():
+    websocket_url = pytest.importorskip("websocket._url")
+    url = "ws://" + format_host("fe80::1%lo", escape_scope=False) + ":1780/jsonrpc"
+    hostname, port, _, _ = websocket_url.parse_url(url)
+    assert socket.getaddrinfo(hostname, port)[0][4][0] == "fe80::1"
+
+
+def test_prefer_routable():
+    assert prefer_routable(["fe80::1%eth0", "192.168.1.2", "2001:db8::1"]) == ["192.168.1.2", "2001:db8::1"]
+    assert prefer_routable(["fe80::1%eth0", "169.254.1.2"]) == ["fe80::1%eth0", "169.254.1.2"]
+
+
+def test_faster_link_local_address_is_not_used(monkeypatch):
+    monkeypatch.setattr(SnapcastServerDiscovery, "get_zeroconf_service_info",
+                        lambda: FakeServiceInfo(["fe80::1%lo", "127.0.0.1"]))
+    # The link-local address would win the ranking
+    latencies = {"fe80::1%lo": 0.001, "127.0.0.1": 0.005}
+    monkeypatch.setattr(SnapcastServerDiscovery, "measure_connect_latency",
+                        lambda address, port, timeout: latencies[address])
+    assert discover_server() == ("127.0.0.1", 1704)
+
+
+def test_link_local_address_without_a_routable_one(monkeypatch):
+    monkeypatch.setattr(SnapcastServerDiscovery, "get_zeroconf_service_info",
+                        lambda: FakeServiceInfo(["fe80::1%lo"]))
+    monkeypatch.setattr(SnapcastServerDiscovery, "measure_connect_latency",
+                        lambda address, port, timeout: 0.001)
+    assert discover_server() == ("fe80::1%lo", 1704)
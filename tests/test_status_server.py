@@ -0,0 +1,64 @@
+import http.client
+
+import pytest
+
+from snapcastmpris.SnapcastStatusServer import SnapcastStatusServer
+
+
+def start_server(state):
+    server = SnapcastStatusServer(lambda: dict(state), port=0)
+    server.start()
+    return server
+
+
+@pytest.fixture
+def state():
+    return {"playback_status": "playing"}
+
+
+@pytest.fixture
+def server(state):
+    server = start_server(state)
+    yield server
+    server.stop()
+    server.join()
+
+
+def get_status(server, etag=None):
+    connection = http.client.HTTPConnection("127.0.0.1", server.httpd.server_address[1], timeout=5)
+    try:
+        connection.request("GET", "/status", headers={"If-None-Match": etag} if etag else {})
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader("ETag")
+    finally:
+        connection.close()
+
+
+def test_matching_etag_is_not_modified(server):
+    status, etag = get_status(server)
+    assert status == 200
+    assert get_status(server, etag) == (304, etag)
+
+
+def test_changed_state_gets_a_new_etag(server, state):
+    _, etag = get_status(server)
+    state["playback_status"] = "pause"
+    server.notify_changed()
+    status, new_etag = get_status(server, etag)
+    assert status == 200
+    assert new_etag != etag
+
+
+def test_etag_of_a_previous_process_does_not_match(server, state):
+    # A restarted process starts counting versions at 0 again
+    previous = start_server(state)
+    try:
+        _, previous_etag = get_status(previous)
+    finally:
+        previous.stop()
+        previous.join()
+    assert previous.etag(0) != server.etag(0)
+    status, etag = get_status(server, previous_etag)
+    assert status == 200
+    assert etag != previous_etag
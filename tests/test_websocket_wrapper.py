@@ -0,0 +1,52 @@
+import json
+import logging
+
+import pytest
+
+pytest.importorskip("websocket")
+
+from snapcastmpris.SnapcastRpcListener import SnapcastRpcListener  # noqa: E402
+from snapcastmpris.SnapcastRpcWebsocketWrapper import SnapcastRpcWebsocketWrapper  # noqa: E402
+
+CLIENT_ID = "00:00:00:00:00:01"
+
+
+class RecordingListener(SnapcastRpcListener):
+
+    def __init__(self):
+        self.notifications = []
+
+    def on_snapserver_notification(self, method, params):
+        self.notifications.append(method)
+
+
+@pytest.fixture
+def wrapper():
+    return SnapcastRpcWebsocketWrapper("127.0.0.1", 1780, CLIENT_ID, RecordingListener(), connect=False)
+
+
+def notification(method, **params):
+    return json.dumps({"jsonrpc": "2.0", "method": method, "params": params})
+
+
+def received_messages(caplog):
+    return [record for record in caplog.records if record.getMessage().startswith("Snapcast RPC websocket message")]
+
+
+def test_client_connect_frames_are_sampled(wrapper, caplog):
+    with caplog.at_level(logging.DEBUG, logger="snapcastmpris.SnapcastRpcWebsocketWrapper"):
+        for _ in range(5):
+            wrapper.on_ws_message(None, notification("Client.OnConnect", id=CLIENT_ID,
+                                                     client={"id": CLIENT_ID, "connected": True}))
+    assert len(received_messages(caplog)) == 1
+    assert wrapper.listener.notifications == ["Client.OnConnect"] * 5
+
+
+def test_other_frames_are_all_logged(wrapper, caplog):
+    with caplog.at_level(logging.DEBUG, logger="snapcastmpris.SnapcastRpcWebsocketWrapper"):
+        for position in range(5):
+            wrapper.on_ws_message(None, notification("Stream.OnProperties", id="default",
+                                                     properties={"position": position}))
+    messages = received_messages(caplog)
+    assert len(messages) == 5
+    assert '"position": 4' in messages[-1].getMessage()